@@ -15,6 +15,17 @@ class ECM_matrix(object):
     size: size of ECM. (should be greater than 1)
     matrix: actual matrix array variable
     has_value: indicates whether the current ECM is set and ready to go
+    sparse: sparse matrix format of matrix ('csr' or 'csc', scipy.sparse).
+        '' means a dense matrix (numpy array).
+    tolerance: allowed difference between the sum of each column and 1.0
+    invalid: columns whose sums were not 1.0 (0 for raw numbers) at the last
+        setting attempt
+    counts: raw numbers the matrix was calculated from (setmatrix_rawvalue),
+        None if ratios were given. Kept for posterior sampling (see
+        Markov_sweep.perturb_posterior).
+    dtype: precision of the matrix (np.float64 or np.float32)
+    matrix64: float64 copy of the matrix if it is stored in a lower
+        precision (dtype), None otherwise. Used as the reference.
     """
 
     # attributes
@@ -24,22 +35,104 @@ class ECM_matrix(object):
     matrix = 0
     # does currently have any matrix value?
     has_value = 0
+    # sparse matrix format ('' = dense)
+    sparse = ''
+    # column sum tolerance, and columns failed to be set
+    tolerance = 1e-9
+    invalid = []
+    # raw numbers (None = ratios were given)
+    counts = None
+    # precision, and the float64 copy for lower precisions
+    dtype = np.float64
+    matrix64 = None
     
-    def __init__(self, condition, size):
+    def __init__(self, condition, size, sparse=''):
         """
         Create ECM class
         Requires condition number and matrix size as parameters.
         Since multiple intervention conditions can be implemented in Markov
             Learning class, condition number should be specified.
+        If sparse is 'csr' or 'csc', the matrix is stored as a scipy.sparse
+            matrix of the format (for large and sparse ECMs).
         """
         # initialization
         # at first, condition number and size should be determinded.
         # as a result a size x size matrix is created.
         self.condition = condition
-        self.matrix = np.zeros((size,size))
+        self.sparse = sparse
+        self.matrix = self.zeros(size)
         self.size = size
         self.has_value = 0
-        
+
+    def zeros(self, size):
+        """
+        Create an empty size x size matrix in the current format (dense or
+            sparse).
+        """
+        if self.sparse:
+            import scipy.sparse as sp
+            return sp.csr_matrix((size,size),dtype=self.dtype).asformat(self.sparse)
+        return np.zeros((size,size),dtype=self.dtype)
+
+    def setsparse(self, sparse):
+        """
+        Change the format of the matrix. sparse: 'csr' or 'csc' (scipy.sparse
+            matrix), or '' (dense numpy array). The current value is kept.
+        If the format is not valid, returns -1 (error)
+        If successful, returns 1
+        """
+        if sparse not in ('','csr','csc'):
+            return -1
+        if sparse:
+            import scipy.sparse as sp
+            self.matrix = sp.csr_matrix(self.matrix).asformat(sparse)
+            if self.matrix64 is not None:
+                self.matrix64 = sp.csr_matrix(self.matrix64).asformat(sparse)
+        elif self.sparse:
+            self.matrix = self.matrix.toarray()
+            if self.matrix64 is not None:
+                self.matrix64 = self.matrix64.toarray()
+        self.sparse = sparse
+        return 1
+
+    def setdtype(self, dtype):
+        """
+        Change the precision of the matrix. dtype: np.float64 or np.float32
+            (or their names). Evolution processes (evolution_t1) are then
+            performed in this precision. For float32, a float64 copy is kept
+            (matrix64).
+        If the precision is not valid, returns -1 (error)
+        If successful, returns 1
+        """
+        dtype = precision_of(dtype)
+        if dtype is None:
+            return -1
+        reference = self.reference()
+        self.dtype = dtype
+        self.store(reference)
+        return 1
+
+    def store(self, matvalue):
+        """
+        Store a float64 matrix (dense or sparse) in the current precision.
+        """
+        if self.dtype == np.float64:
+            self.matrix = matvalue
+            self.matrix64 = None
+        else:
+            self.matrix = matvalue.astype(self.dtype)
+            self.matrix64 = matvalue
+
+    def reference(self):
+        """
+        Returns the matrix in float64 (matrix64 for lower precisions).
+        """
+        if self.matrix64 is not None:
+            return self.matrix64
+        if self.matrix.dtype != np.float64:
+            return self.matrix.astype(np.float64)
+        return self.matrix
+
     def setsize(self,size):
         """
         Reset the matrix size.
@@ -53,7 +146,8 @@ class ECM_matrix(object):
         if size < 2:
             # failed
             return -1
-        self.matrix = np.zeros((size,size))
+        self.matrix = self.zeros(size)
+        self.matrix64 = None
         self.size = size
         self.has_value = 0
         # size change successful
@@ -64,36 +158,58 @@ class ECM_matrix(object):
         Set the current matrix elements as ratio (0 - 1.0)
         Check whether the new matrix size is identical to preset matrix size.
         If not, returns -10 (error)
-        Check whether the sum of each column is 1.0
-        If not, setting fails -> returns -11 (error)
+        Check whether the sum of each column is 1.0 (within self.tolerance)
+        If not, setting fails -> returns -11 (error), and the failed columns
+            are listed in self.invalid
         If successful -> returns 1
         matvalue is stored in self.matvalue, and set has_value as 1
         """
+        # sparse matrix? then validate in sparse form
+        if self.sparse:
+            return self.setmatrix_ratio_sparse(matvalue)
+
         # if the current input value represents ratio (0 - 1.0)
         # first, check the size of the input matrix
         # if it does not fit into the current matrix size, fail
-        if (len(self.matrix) != len(matvalue)):
+        matvalue = np.array(matvalue,dtype=float)
+        if matvalue.shape != (self.size,self.size):
             return -10
-        # check whether the sum of each column is 1
-        flag = 0
-        
-        for i in range(self.size):
-            col_sum = 0
-            for j in range(self.size):
-                col_sum = col_sum + matvalue[j][i]
-
-            # equal to 1?
-            if (col_sum != 1) and (col_sum != 1.0):
-                flag = 1
-            if (col_sum == 1.0):
-                flag = 0
-                
+        # check whether the sum of each column is 1 (within the tolerance)
+        col_sum = np.sum(matvalue,axis=0)
+        self.invalid = [int(i) for i in np.where(np.abs(col_sum-1.0) > self.tolerance)[0]]
+
         # if at least the sum of one col is not 1, then error
-        if (flag):
+        if len(self.invalid) > 0:
             return -11
         
         # if there is no error, then update the matrix
-        self.matrix = matvalue
+        self.store(matvalue)
+        self.counts = None
+        # now, it has a value
+        self.has_value = 1
+        return 1
+
+    def setmatrix_ratio_sparse(self, matvalue):
+        """
+        setmatrix_ratio for sparse matrices. matvalue can be dense or any
+            scipy.sparse matrix, and is stored in the current sparse format.
+        Column sums are checked in sparse form (O(nnz)) within
+            self.tolerance.
+        Return values are identical to those of setmatrix_ratio.
+        """
+        import scipy.sparse as sp
+        matvalue = sp.csr_matrix(matvalue,dtype=float)
+        # size should match
+        if matvalue.shape != (self.size,self.size):
+            return -10
+        # the sum of each column should be 1
+        col_sum = np.asarray(matvalue.sum(axis=0)).ravel()
+        self.invalid = [int(i) for i in np.where(np.abs(col_sum-1.0) > self.tolerance)[0]]
+        if len(self.invalid) > 0:
+            return -11
+
+        self.store(matvalue.asformat(self.sparse))
+        self.counts = None
         # now, it has a value
         self.has_value = 1
         return 1
@@ -102,21 +218,47 @@ class ECM_matrix(object):
         """
         Set the current matrix elements as absolute values
         Check whether the new matrix size is identical to preset matrix size.
-        If not, returns -10 (error)
+        If not, returns -1 (error)
+        Check whether the sum of each column is greater than 0.
+        If not, setting fails -> returns -13 (error), and the failed columns
+            are listed in self.invalid
         If successful -> returns 1
         matvalue is stored in self.matvalue, and set has_value as 1
         """
+        # sparse matrix? normalise in sparse form (O(nnz))
+        if self.sparse:
+            import scipy.sparse as sp
+            matvalue = sp.csc_matrix(matvalue,dtype=float)
+            if matvalue.shape != (self.size,self.size):
+                return -1
+            # no column can be divided by a zero sum
+            col_sum = np.asarray(matvalue.sum(axis=0)).ravel()
+            self.invalid = [int(i) for i in np.where(col_sum == 0)[0]]
+            if len(self.invalid) > 0:
+                return -13
+            self.counts = matvalue.copy()
+            # divide each column by its sum
+            matvalue = matvalue @ sp.diags(1.0/col_sum)
+            self.store(matvalue.asformat(self.sparse))
+            self.has_value = 1
+            return 1
+
         # if the current input value represents ratio (0 - 1.0)
         # first, check the size of the input matrix
         # if it does not fit into the current matrix size, fail
-        if (len(self.matrix) != len(matvalue)):
+        matvalue = np.array(matvalue,dtype=float)
+        if matvalue.shape != (self.size,self.size):
             return -1
+        # no column can be divided by a zero sum
+        col_sum = np.sum(matvalue, axis = 0)
+        self.invalid = [int(i) for i in np.where(col_sum == 0)[0]]
+        if len(self.invalid) > 0:
+            return -13
+        # keep raw numbers
+        self.counts = matvalue
         # calculate ratio matrix from raw numbers
         # e.g., a00 = A00 / (A00 + A10)
-        col_sum = np.sum(matvalue, axis = 0)
-        for i in range(self.size):
-            for j in range(self.size):
-                self.matrix[i][j] = float(matvalue[i][j]) / float(col_sum[j])
+        self.store(matvalue / col_sum)
         
         # now, it has a value
         self.has_value = 1
@@ -134,8 +276,148 @@ class ECM_matrix(object):
         # t0value is the current status
 
         # sizes (matrix and t0value) should match
-        if (len(self.matrix) != len(t0value)):
+        if (self.size != len(t0value)):
             return None
 
+        # sparse matrix -> sparse mat-vec, O(nnz)
+        if self.sparse:
+            return self.matrix.dot(np.asarray(t0value,dtype=self.dtype))
+
         # if match, then calculate the product of two matrices
-        return np.dot(self.matrix,t0value)
+        return np.dot(self.matrix,np.asarray(t0value,dtype=self.dtype))
+
+    def stationary(self):
+        """
+        Calculate the stationary distribution of the matrix (the eigenvector
+            of eigenvalue 1, pi = matrix . pi), normalized to sum to 1.0.
+        If the chain has several stationary distributions (reducible), one
+            of them is returned.
+        If the matrix is not set, returns None (error)
+        If successful, returns the stationary distribution (size).
+        """
+        if not self.has_value:
+            return None
+        return stationary_of(self.reference())
+
+    def spectral_gap(self):
+        """
+        Calculate the second largest eigenvalue modulus of the matrix and the
+            spectral gap (1 - the modulus). The larger the gap, the faster
+            participant states converge to the stationary distribution.
+        If the matrix is not set, returns None (error)
+        If successful, returns (spectral gap, second eigenvalue modulus).
+        """
+        if not self.has_value:
+            return None
+        values = eigenvalues_of(self.reference(),2)
+        if len(values) < 2:
+            return (1.0,0.0)
+        return (1.0-values[1],values[1])
+
+    def mixing_time(self, epsilon=1e-6):
+        """
+        Calculate the number of evolution steps required for any participant
+            states to get within epsilon (total variation distance) of the
+            stationary distribution (mixing_steps).
+        If the matrix is not set, returns None (error)
+        If states never converge (e.g., a periodic chain), returns -1
+        If successful, returns the number of steps.
+        """
+        if not self.has_value:
+            return None
+        if self.sparse:
+            return mixing_steps(self.reference().toarray(),epsilon)
+        return mixing_steps(self.reference(),epsilon)
+
+def precision_of(dtype):
+    """
+    Floating point type of a precision (np.float64, np.float32 or their
+        names), or None if it is not supported.
+    """
+    try:
+        dtype = np.dtype(dtype).type
+    except TypeError:
+        return None
+    if dtype not in (np.float64, np.float32):
+        return None
+    return dtype
+
+def stationary_of(matrix):
+    """
+    Calculate the stationary distribution of a column-stochastic matrix
+        (dense or scipy.sparse), normalized to sum to 1.0.
+    """
+    if hasattr(matrix,'toarray') and (matrix.shape[0] > 2):
+        import scipy.sparse.linalg as sl
+        values, vectors = sl.eigs(matrix,k=1,which='LM')
+        vector = vectors[:,0]
+    else:
+        if hasattr(matrix,'toarray'):
+            matrix = matrix.toarray()
+        values, vectors = np.linalg.eig(matrix)
+        # eigenvalue closest to 1
+        vector = vectors[:,np.argmin(np.abs(values-1.0))]
+    vector = np.abs(np.real(vector))
+    return vector / np.sum(vector)
+
+def eigenvalues_of(matrix, k=0):
+    """
+    Calculate moduli of eigenvalues of a matrix (dense or scipy.sparse) in
+        descending order. If k > 0, only the k largest ones.
+    """
+    if hasattr(matrix,'toarray'):
+        if 0 < k < matrix.shape[0] - 1:
+            import scipy.sparse.linalg as sl
+            values = sl.eigs(matrix,k=k,which='LM',return_eigenvectors=False)
+            return np.sort(np.abs(values))[::-1]
+        matrix = matrix.toarray()
+    values = np.sort(np.abs(np.linalg.eigvals(matrix)))[::-1]
+    if k > 0:
+        return values[:k]
+    return values
+
+def mixing_steps(matrix, epsilon=1e-6, start=None, powers=None, limit=60):
+    """
+    Calculate the smallest number of steps t such that participant states
+        after t steps are within epsilon (total variation distance) of the
+        stationary distribution of a dense column-stochastic matrix.
+    start: participant states at t0 (size, or size x k for several of them).
+        If None, the worst case over all single states (the identity).
+    powers: list of matrix^(2^k) (powers[0] is the matrix itself), extended
+        in place if given, so that cached powers can be reused.
+    The distance does not increase with t, so powers of 2^k are squared until
+        the distance gets within epsilon (doubling), and t is found by binary
+        lifting with those powers. The cost is O(log(t)) matrix products.
+    If states do not converge within 2^limit steps, returns -1
+    """
+    if powers is None:
+        powers = [np.asarray(matrix,dtype=float)]
+    pi = stationary_of(powers[0])
+    if start is None:
+        state = np.identity(len(pi))
+    else:
+        state = np.asarray(start,dtype=float).reshape(len(pi),-1)
+        state = state / np.sum(state,axis=0)
+
+    def distance(now):
+        # worst total variation distance among columns
+        return 0.5 * np.max(np.sum(np.abs(now-pi[:,None]),axis=0))
+
+    if distance(state) <= epsilon:
+        return 0
+    # doubling: find k such that 2^k steps are enough
+    k = 0
+    while distance(np.dot(powers[k],state)) > epsilon:
+        k = k + 1
+        if k > limit:
+            return -1
+        if k == len(powers):
+            powers.append(np.dot(powers[k-1],powers[k-1]))
+    # binary lifting: the largest t with the distance still above epsilon
+    t = 0
+    for j in reversed(range(k)):
+        now = np.dot(powers[j],state)
+        if distance(now) > epsilon:
+            state = now
+            t = t + (1 << j)
+    return t + 1
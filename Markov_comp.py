@@ -3,14 +3,36 @@
 
 import numpy as np
 import Markov_learning as ml
-import copy
+import Markov_schedule as sc
+import concurrent.futures as cf
 
 class Markov_comp(object):
+    """
+    Attribute description:
+    ML: Markov learning classes (models) to be compared, one per ECM set
+        (e.g., different cohorts or estimation variants). All models share
+        conditions, size, length and intervention schedules.
+    num_ML: number of models
+    conditions, size, length: identical to those of Markov learning classes
+    schedules: number of intervention schedules
+    schedule: intervention schedules shared by all models (schedules x
+        length). The schedule of each model is this array, not a copy.
+    status_t0: default participant states at t0 of new models
+    status_t_now: participant states of all models (models x schedules x
+        length x size). status_t_now of each model is a view of it.
+    ECM_stack: ECMs of all models (models x conditions x size x size)
+    comp_evol: arrays indicating whether an evolution process for a certain
+        intervention schedule is completed (for all models).
+    pairs: model pairs compared by the last comp_models call
+    tresult_models: t-test results per model pair and schedule (pairs x
+        schedules x 4, see comp_models)
+    fastresult_models: closed-form mixed effects analyses per model pair and
+        schedule (pairs x schedules x 8, see comp_models)
+    """
     # attributes
-    # it may have multiple Markov_learning objects
-    # maximum, 10
+    # Markov_learning objects (models)
     ML=[]
-    # how many MLs? for comparison between different evolution schedules.
+    # how many MLs? for comparison between different ECM sets.
     num_ML = 0
     # testmode?
     test_mode = 0
@@ -22,38 +44,307 @@ class Markov_comp(object):
     status_t0 = 0
     # total time length
     length = 0
+    # shared intervention schedules
+    schedules = 0
+    schedule = []
+    # states of all models (models x schedules x length x size)
+    status_t_now = []
+    # ECMs of all models (models x conditions x size x size)
+    ECM_stack = []
+    # evolution completed?
+    comp_evol = []
     # matrix for comparison-regression.
     comp_matrix = []
+    # comparisons between models
+    pairs = []
+    tresult_models = []
+    fastresult_models = []
 
-
-    
     def __init__(self, conditions, size, length, schedules):
+        """
+        Create Markov comparison class
+        Requires condition number, participant status number, length of
+            intervention schedules, and number of intervention schedules,
+            shared by all models (see add_model).
+        Test mode is activated when all parameters are -1
+        """
         #initialize
+        # models are kept per instance
+        self.ML = []
+        self.pairs = []
         # test mode, if all -1s
         if conditions == -1 & size == -1 & length == -1 & schedules == -1:
             # test mode, as published
             self.conditions = 3
             self.size = 2
+            self.ML = [ml.Markov_learning(-1,-1,-1,-1),ml.Markov_learning(-2,-2,-2,-2)]
             self.num_ML = 2
- #           x = ml.Markov_learning(-1,-1,-1)
-#            self.ML.append(x)
-#            y = ml.Markov_learning(-2,-2,-2)
-#            self.ML.append(y)
-            self.ML_test1=copy.copy(ml.Markov_learning(-1,-1,-1))
-            self.ML_test2=copy.copy(ml.Markov_learning(-2,-2,-2))
-#            self.ML = [ml.Markov_learning(-1,-1,-1),ml.Markov_learning(-2,-2,-2)]
-#            self.ML = [ml.Markov_learning() for i in range(2)]
-#            self.ML[0] = ml.Markov_learning(-1,-1,-1)
-#            self.ML[1] = ml.Markov_learning(-2,-2,-2)
-            
             self.test_mode = 1
             self.length = 100
             self.status_t0 = np.zeros((self.size))
+        else:
+            self.conditions = conditions
+            self.size = size
+            self.length = length
+            self.schedules = schedules
+            self.num_ML = 0
+            self.test_mode = 0
+            self.status_t0 = np.zeros((size))
+            # schedules shared by all models
+            self.schedule = np.zeros((self.schedules,self.length),dtype=sc.schedule_dtype(conditions))
+            self.comp_evol = np.zeros((self.schedules))
+
+    def add_model(self, matvalues=None, t0=None, raw=0):
+        """
+        Add a model (Markov learning class) sharing conditions, size, length
+            and intervention schedules of this class.
+        matvalues: ECMs of the model (conditions x size x size), set with
+            Markov_learning.setECM_all (raw: raw counts). If None, ECMs
+            should be set later (self.ML[model]).
+        t0: participant states at t0 of the model. If None, self.status_t0.
+        If this class is in the test mode, returns -1 (error)
+        If ECMs cannot be set, returns the error code of setECM_all
+            (-10 to -13)
+        If t0 cannot be set, returns -2 (error)
+        If successful, returns the model number.
+        """
+        if self.test_mode:
+            return -1
+        # no schedule -> status_t_now is not allocated per model
+        model = ml.Markov_learning(self.conditions,self.size,self.length,0)
+        if matvalues is not None:
+            error = model.setECM_all(matvalues,raw)
+            if error < 0:
+                return error
+        if t0 is None:
+            t0 = self.status_t0
+        if model.set_t0(np.array(t0,dtype=float)) < 0:
+            return -2
+
+        # share schedules
+        model.schedules = self.schedules
+        model.schedule = self.schedule
+        model.comp_evol = np.zeros((self.schedules))
+        self.ML.append(model)
+        self.num_ML = len(self.ML)
+        # evolution is required again for all models
+        self.status_t_now = []
+        self.comp_evol[:] = 0
+        return self.num_ML - 1
+
+    def set_t0(self, t0, model=-1):
+        """
+        Set the initial participant states at t0 of a model, or of all models
+            (and new models) if model == -1.
+        If the size of t0 does not match with self.size, returns -1 (error)
+        If model is out of boundary, returns -2 (error)
+        If successful, returns 1.
+        """
+        if len(t0) != self.size:
+            return -1
+        if model == -1:
+            self.status_t0 = np.array(t0,dtype=float)
+            for now in self.ML:
+                now.set_t0(np.array(t0,dtype=float))
+        elif (model < 0) or (model >= self.num_ML):
+            return -2
+        else:
+            self.ML[model].set_t0(np.array(t0,dtype=float))
+        self.comp_evol[:] = 0
+        return 1
+
+    def set_schedule(self, num_schedule, schedule):
+        """
+        Set an intervention schedule, num_schedule, shared by all models.
+        Error codes are identical to those of Markov_learning.set_schedule.
+        If successful, returns 1
+        """
+        # if num_schedules out of boundary? error
+        if (num_schedule < 0) or (num_schedule >= self.schedules):
+            return -1
+        # length should match
+        if len(schedule) != self.length:
+            return -2
+        # conditions should be in the boundary
+        if np.any(np.asarray(schedule) >= self.conditions) or np.any(np.asarray(schedule) < 0):
+            return -3
+
+        self.schedule[num_schedule] = schedule
+        self.comp_evol[num_schedule] = 0
+        return 1
+
+    def stack_ECM(self):
+        """
+        Stack ECMs of all models into one (models, conditions, size, size)
+            array, self.ECM_stack (dense, even for sparse ECMs).
+        If ECMs of any model cannot be stacked, returns -1 (error)
+        If successful, returns 1
+        """
+        stack = np.zeros((self.num_ML,self.conditions,self.size,self.size))
+        for m in range(self.num_ML):
+            if self.ML[m].stack_ECM() < 0:
+                return -1
+            for c in range(self.conditions):
+                now = self.ML[m].ECM_stack[c]
+                stack[m,c] = now.toarray() if hasattr(now,'toarray') else now
+        self.ECM_stack = stack
+        return 1
+
+    def evolution_models(self, subset=None):
+        """
+        Perform evolution from t = 0 to self.length for all models and all
+            intervention schedules (or a subset of them) at once.
+        Participant states of all models are one (models, schedules, size)
+            array, and each t is one batched product per condition for all
+            models and schedules applying it.
+        Results are stored in self.status_t_now, and status_t_now of each
+            model becomes a view of it, so that methods of each model
+            (create_comp_matrix, comp_all_schedules_t, ...) can be used.
+        subset: list of schedule numbers to be evolved. If None, all schedules
+            are evolved.
+        If any schedule number in subset is out of boundary, returns -1
+            (error)
+        If subset is empty, returns -2 (error)
+        If there is no model, returns -3 (error)
+        If participant states at t0 of any model were not set, returns -4
+            (error)
+        If ECMs cannot be stacked (stack_ECM), returns -5 (error)
+        If successful, returns 1
+        """
+        # which schedules?
+        if subset is None:
+            subset = np.arange(self.schedules)
+        subset = np.asarray(subset,dtype=int).reshape(-1)
+
+        # schedule numbers should be in the boundary
+        if np.any(subset < 0) or np.any(subset >= self.schedules):
+            return -1
+        if len(subset) == 0:
+            return -2
+        if self.num_ML == 0:
+            return -3
+        for now in self.ML:
+            if not np.any(now.status_t0):
+                return -4
+        if self.stack_ECM() < 0:
+            return -5
+
+        # states of all models, allocated once per set of models
+        if np.shape(self.status_t_now) != (self.num_ML,self.schedules,self.length,self.size):
+            self.status_t_now = np.zeros((self.num_ML,self.schedules,self.length,self.size))
+            self.comp_evol[:] = 0
+            for m in range(self.num_ML):
+                self.ML[m].status_t_now = self.status_t_now[m]
+
+        cond = self.schedule[subset].astype(int)
+        # all schedules of a model start from its t0
+        state = np.zeros((self.num_ML,len(subset),self.size))
+        for m in range(self.num_ML):
+            state[m] = np.asarray(self.ML[m].status_t0,dtype=float)
+        # (models x conditions x size x size) -> transposed for row states
+        stack_t = np.ascontiguousarray(np.transpose(self.ECM_stack,(1,0,3,2)))
+
+        # evolution start
+        for i in range(self.length):
+            for c in range(self.conditions):
+                now = (cond[:,i] == c)
+                if np.any(now):
+                    state[:,now] = np.matmul(state[:,now],stack_t[c])
+            self.status_t_now[:,subset,i] = state
+
+        # evolution for these schedules completed, for all models
+        self.comp_evol[subset] = 1
+        for now in self.ML:
+            now.comp_evol[subset] = 1
+            now.comp_done = 0
+        return 1
+
+    def model_groups(self, model1, model2, cond1, cond2, types):
+        """
+        Create the two groups compared between two models for all schedules.
+        types: 0 (cond1), 1 (cond2), 2 (cond1 - cond2), 3 (cond1 / cond2),
+            calculated within each model.
+        Returns group1 (model1, schedules x length) and group2 (model2).
+        """
+        groups = []
+        for m in (model1,model2):
+            status = self.status_t_now[m]
+            if types == 0:
+                groups.append(status[:,:,cond1])
+            elif types == 1:
+                groups.append(status[:,:,cond2])
+            elif types == 2:
+                groups.append(status[:,:,cond1]-status[:,:,cond2])
+            else:
+                groups.append(status[:,:,cond1]/status[:,:,cond2])
+        return groups[0], groups[1]
+
+    def comp_pair(self, task):
+        """
+        Compare two models for all schedules (a task of comp_models).
+        Returns results (schedules x 4 or 8).
+        """
+        model1, model2, cond1, cond2, types, method = task
+        group1, group2 = self.model_groups(model1,model2,cond1,cond2,types)
+        if method == 'mixed':
+            return self.ML[0].mixed_batch(group1,group2)
+        result = self.ML[0].t_test_batch(group1,group2)
+        # Sidak's correction for the comparisons of all schedules
+        result[:,2] = 1.0-np.power((1.0-result[:,1]),float(self.schedules))
+        return result
+
+    def comp_models(self, cond1, cond2, types, pairs=None, workers=1, method='t'):
+        """
+        Compare participant states of models for every intervention
+            schedule (model 1 vs. model 2 at t = 0 to self.length).
+        DV: cond1 or cond2 or cond1-cond2 or cond1/cond2 (types 0 to 3)
+        pairs: list of (model1, model2). If None, all pairs of models.
+        workers: number of threads comparing model pairs in parallel.
+            Participant states are shared by threads without copying them.
+        method: 't', t-tests (Markov_learning.t_test_batch; Sidak's correction
+            for self.schedules comparisons), stored in self.tresult_models
+            (pairs x schedules x 4; tvalue, pvalue, Sidak's pvalue, Cohen's
+            D; model1 - model2).
+            'mixed', closed-form mixed effects analyses (Markov_learning.
+            mixed_batch; SCH = 1 for model2), stored in
+            self.fastresult_models (pairs x schedules x 8).
+        If evolution for any schedule was not completed (evolution_models),
+            returns -1 (error)
+        If cond1 or cond2 is out of boundary (self.size), returns -2 (error)
+        If types or method is not valid, returns -3 (error)
+        If any model number in pairs is out of boundary, returns -4 (error)
+        If successful, returns 1
+        """
+        if (self.num_ML == 0) or np.any(self.comp_evol == 0):
+            return -1
+        if (cond1 < 0) or (cond1 >= self.size) or (cond2 < 0) or (cond2 >= self.size):
+            return -2
+        if (types not in (0,1,2,3)) or (method not in ('t','mixed')):
+            return -3
+        if pairs is None:
+            pairs = [(i,j) for i in range(self.num_ML) for j in range(i+1,self.num_ML)]
+        for model1, model2 in pairs:
+            if min(model1,model2) < 0 or max(model1,model2) >= self.num_ML:
+                return -4
+
+        tasks = [(model1,model2,cond1,cond2,types,method) for model1, model2 in pairs]
+        if workers > 1:
+            with cf.ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(self.comp_pair,tasks))
+        else:
+            results = [self.comp_pair(task) for task in tasks]
 
+        self.pairs = list(pairs)
+        width = 8 if method == 'mixed' else 4
+        results = np.array(results).reshape(len(pairs),self.schedules,width)
+        if method == 'mixed':
+            self.fastresult_models = results
+        else:
+            self.tresult_models = results
+        return 1
 
     # testmode
     def test1(self):
         if self.test_mode < 1:
             return -1
-        self.ML[0].test1()
-        
+        return self.ML[0].test1()
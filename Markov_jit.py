@@ -0,0 +1,137 @@
+"""
+Markov jit v1.0
+This module implements a compiled evolution kernel for small ECMs, running
+the whole schedule x time loop in native code
+"""
+
+# Kernel module
+# For small ECMs (size up to MAX_SIZE), each evolution step is a tiny mat-vec
+# product, so evolution processes are dominated by the overhead of NumPy
+# calls per step. evolve runs all schedules and ts in one call:
+#   - compiled with Numba (if installed), one schedule per core (prange).
+#     Numba is imported and the kernel is compiled on the first call
+#     (load_numba), so importing this module only requires numpy. Its
+#     threads use Numba's workqueue layer, which (unlike the OpenMP and TBB
+#     layers) leaves nothing running that would hang processes forked
+#     afterwards (e.g., Markov_learning.comp_all_schedules_mixed with
+#     workers > 1).
+#   - otherwise with NumPy, vectorized over schedules
+# Both perform the same floating point operations in the same order, so
+# their results are identical.
+# Markov_learning.evolution_batch selects this kernel automatically (see
+# Markov_learning.set_jit).
+
+import importlib.util
+import os
+import numpy as np
+
+# Numba and the compiled kernel (load_numba)
+numba = None
+evolve_compiled = None
+
+# ECMs up to this size use the kernel. For larger ones, the per-step
+# overhead is small compared with products (Markov_learning.evol_step).
+MAX_SIZE = 4
+
+# is Numba installed? (checked without importing it)
+compiled = importlib.util.find_spec('numba') is not None
+# parallel loop of the kernel (numba.prange once Numba is loaded)
+prange = range
+
+def evolve_loops(stack, cond, state, out, renormalize, total, offset):
+    """
+    Kernel with explicit loops (compiled by Numba).
+    Participant states of schedule s at t are stored in out[s, t], and state
+        (schedules x size) is updated to the last ones.
+    """
+    schedules, length = cond.shape
+    size = state.shape[1]
+    for s in prange(schedules):
+        new = np.empty(size,dtype=state.dtype)
+        # scale in the precision of states
+        scale = np.empty(1,dtype=state.dtype)
+        for t in range(length):
+            c = cond[s,t]
+            for i in range(size):
+                acc = stack[c,i,0] * state[s,0]
+                for j in range(1,size):
+                    acc = acc + stack[c,i,j] * state[s,j]
+                new[i] = acc
+            if (renormalize > 0) and ((offset+t+1) % renormalize == 0):
+                now = 0.0
+                for i in range(size):
+                    now = now + np.float64(new[i])
+                scale[0] = total / now
+                for i in range(size):
+                    new[i] = new[i] * scale[0]
+            for i in range(size):
+                out[s,t,i] = new[i]
+                state[s,i] = new[i]
+
+def evolve_numpy(stack, cond, state, out, renormalize, total, offset):
+    """
+    Kernel vectorized over schedules (NumPy), identical to evolve_loops.
+    """
+    schedules, length = cond.shape
+    size = state.shape[1]
+    now_state = state.copy()
+    new = np.empty_like(state)
+    acc = np.empty((schedules),dtype=state.dtype)
+    for t in range(length):
+        # ECMs of each schedule at t (schedules x size x size)
+        now = stack[cond[:,t]]
+        for i in range(size):
+            np.multiply(now[:,i,0],now_state[:,0],out=acc)
+            for j in range(1,size):
+                acc += now[:,i,j] * now_state[:,j]
+            new[:,i] = acc
+        if (renormalize > 0) and ((offset+t+1) % renormalize == 0):
+            mass = np.zeros((schedules))
+            for i in range(size):
+                mass += new[:,i]
+            new *= (total / mass).astype(state.dtype)[:,None]
+        out[:,t] = new
+        now_state, new = new, now_state
+    state[:] = now_state
+
+def load_numba():
+    """
+    Import Numba and compile evolve_loops (once).
+    Returns the compiled kernel, or None if Numba is not installed.
+    """
+    global numba, evolve_compiled, prange, compiled
+    if (evolve_compiled is None) and compiled:
+        try:
+            import numba
+        except ImportError:
+            compiled = False
+            return None
+        # fork-safe threads, unless the user selected a layer
+        # (NUMBA_THREADING_LAYER)
+        if 'NUMBA_THREADING_LAYER' not in os.environ:
+            numba.config.THREADING_LAYER = 'workqueue'
+        prange = numba.prange
+        evolve_compiled = numba.njit(parallel=True,cache=True)(evolve_loops)
+    return evolve_compiled
+
+def evolve(stack, cond, state, out, renormalize=0, total=0.0, offset=0, jit=1):
+    """
+    Evolve schedules with stacked dense ECMs (conditions x size x size)
+        from their participant states, state (schedules x size, updated in
+        place to the last states). cond contains conditions of schedules
+        (schedules x ts), and participant states are stored in out
+        (schedules x ts x size). Long schedules are evolved window by window
+        (offset = t of the first column of cond).
+    renormalize: if > 0, states are rescaled every renormalize steps (from
+        t = 0) so that the number of all participants is total.
+    jit: use the compiled kernel if available (0 = NumPy).
+    Returns out.
+    """
+    stack = np.ascontiguousarray(stack,dtype=out.dtype)
+    cond = np.ascontiguousarray(cond)
+    kernel = load_numba() if jit else None
+    if kernel is not None:
+        kernel(stack,cond,state,out,int(renormalize),float(total),int(offset))
+    else:
+        evolve_numpy(stack,cond,state,out,int(renormalize),float(total),int(offset))
+    return out
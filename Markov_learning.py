@@ -8,10 +8,22 @@ This class was designed to implement Markov learning processes with ECM
 
 import numpy as np
 import ECM_matrix as em
-import pandas as pd
-import statsmodels.api as sm
-import statsmodels.stats as ss
-from scipy.stats.mstats import zscore
+import Prefix_cache as pc
+import Markov_sink as ms
+import Markov_reducer as mr
+import Markov_schedule as sc
+import Markov_jit as mj
+import concurrent.futures as cf
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+
+# statistics packages are imported on first use (load_pandas, load_scipy,
+# load_statsmodels), so that evolution processes only require numpy
+pd = None
+st = None
+sm = None
+ss = None
 
 class Markov_learning(object):
     """
@@ -24,7 +36,9 @@ class Markov_learning(object):
     status_t_now: arrays containing participant states at certan ts. They will
         be calculated during evolution processes
     length: how many iterations will occur during evolution processes?
-    schedule: arrays containing intervention schedules
+    schedule: arrays containing intervention schedules (compact unsigned
+        integers, see Markov_schedule.schedule_dtype), or a schedule family
+        generating them lazily (set_schedule_family)
     num_schedules: how many intervention schedules will be set?
     comp_evol: arrays indicating whether an evolution process for a certain
         intervention schedule is completed.
@@ -41,6 +55,33 @@ class Markov_learning(object):
         intervention schedules.
     mixedresult_regular: contains multiple results from mixed effects analyses
         between regular intervention schedules.
+    fastresult: contains results from a closed-form mixed effects analysis.
+    fastresult_regular: contains multiple results from closed-form mixed
+        effects analyses between regular intervention schedules.
+    ECM_stack: matrices of all ECMs stacked into one (conditions, size, size)
+        array for batched evolution processes.
+    period_cache: products of ECMs over one period of periodic intervention
+        schedules and their powers, stored per schedule pattern.
+    prefix_cache: prefix-trie cache of participant states shared by schedules
+        with common prefixes.
+    sink: output sink receiving participant states of evolved schedules
+        (see Markov_sink). One csv file per schedule by default.
+    store_path: if set, status_t_now is backed by a memory-mapped .npy file
+        at this path instead of memory.
+    sparse: sparse matrix format of ECMs ('csr' or 'csc'), '' for dense ECMs.
+    ECM_error: (condition, column) pairs failed at the last setECM_all call.
+    mc_mean, mc_quantiles, mc_replicates: results of the stochastic (Monte
+        Carlo) evolution process (evolution_stochastic).
+    reduced: statistics of schedules calculated by reducers during the last
+        evolution_reduce call (dataframe, one row per schedule).
+    dtype: precision of ECMs, status_t_now and comp_mat (np.float64 or
+        np.float32, see set_precision).
+    renormalize: if > 0, participant states are rescaled every renormalize
+        steps so that the number of all participants does not drift.
+    precision_error: maximum deviation from the float64 reference found by
+        the last precision_check call.
+    jit: evolution kernel for small ECMs (see set_jit). 1 (default) =
+        compiled if Numba is installed, 2 = NumPy version only, 0 = off.
     """
     # attributes
     # it has ECM
@@ -82,19 +123,60 @@ class Markov_learning(object):
     # for repeted t-test and mixed effects model analysis (regular test purpose)
     tresult_regular=[]
     mixedresult_regular=[]
-
-    def __init__(self, conditions, size, length, schedules):
+    # closed-form mixed effects analyses (balanced two-schedule design)
+    fastresult=[]
+    fastresult_regular=[]
+    # all ECMs in one array (conditions x size x size), for batched evolution
+    ECM_stack = []
+    # cached period products for periodic schedules (pattern -> products)
+    period_cache = {}
+    # prefix-trie cache of states (shared schedule prefixes)
+    prefix_cache = 0
+    # output sink
+    sink = 0
+    # memory-mapped trajectory store (status_t_now), '' = in memory
+    store_path = ''
+    # sparse ECMs? ('' = dense)
+    sparse = ''
+    # failed (condition, column) pairs of the last bulk ECM setting
+    ECM_error = []
+    # stochastic evolution (Monte Carlo) results
+    mc_mean = []
+    mc_quantiles = []
+    mc_replicates = []
+    # reduced statistics (evolution_reduce)
+    reduced = []
+    # precision and renormalisation of participant states
+    dtype = np.float64
+    renormalize = 0
+    precision_error = 0
+    # evolution kernel for small ECMs (Markov_jit)
+    jit = 1
+
+    def __init__(self, conditions, size, length, schedules, dtype=np.float64):
         """
         Create Markov learning class
         Requires condition number, participant status number, length of
             intervention schedules, and number of intervention schedules
+        dtype: precision of ECMs and participant states (see set_precision).
+            Unsupported precisions are regarded as np.float64.
         Several test modes are activated when all parameters are smaller than 0
         """
         # initialize
 
+        # precision (before any array is allocated)
+        self.dtype = em.precision_of(dtype) or np.float64
+        # ECMs are kept per instance (not shared by all classes)
+        self.ECM = []
         # tresult is always common. [0] t-value [1] p-value [2] Sidak p-value [3] Cohen's D
         self.tresult=np.zeros((4))
-        
+        # fastresult is also common. see comp_mixed_fast
+        self.fastresult=np.zeros((8))
+        # period products are cached per instance
+        self.period_cache = {}
+        # one csv file per schedule, by default
+        self.sink = ms.CSV_sink()
+
         # test mode, if conditions == -1 & size == -1
         if conditions == -1 & size == -1 & length == -1 & schedules == -1:
             # test mode, as published
@@ -106,7 +188,7 @@ class Markov_learning(object):
             self.schedules = 2
             self.length = 100
             self.status_t_now = np.zeros((self.schedules,self.length,self.size))
-            self.schedule = np.zeros((self.schedules,self.length))
+            self.schedule = np.zeros((self.schedules,self.length),dtype=sc.schedule_dtype(self.conditions))
             self.comp_evol = np.zeros((self.schedules))
             self.comp_mat = np.zeros((self.length * 2,6))
             self.tgroup1 = np.zeros((self.length))
@@ -143,11 +225,11 @@ class Markov_learning(object):
             
             # schedule == 0, then regular case. If not, then create schedule var.
             if schedules > 0:
-                self.schedule = np.zeros((self.schedules,self.length))
+                self.schedule = np.zeros((self.schedules,self.length),dtype=sc.schedule_dtype(self.conditions))
                 # reset status_t_now and schedule variables per num of set schedules
-                self.status_t_now = np.zeros((self.schedules,self.length,self.size))
+                self.status_t_now = np.zeros((self.schedules,self.length,self.size),dtype=self.dtype)
                 self.comp_evol=np.zeros((self.schedules))
-            self.comp_mat = np.zeros((self.length*2,6))
+            self.comp_mat = np.zeros((self.length*2,6),dtype=self.dtype)
             self.tgroup1 = np.zeros((self.length))
             self.tgroup2 = np.zeros((self.length))
 
@@ -190,6 +272,7 @@ class Markov_learning(object):
         # create empty ECMs
         for i in range(conditions):
             x = em.ECM_matrix(i,size)
+            x.setdtype(self.dtype)
             self.ECM.append(x)
 
         # creation was successful
@@ -222,6 +305,75 @@ class Markov_learning(object):
 
         return success
 
+    def setECM_all(self, matvalues, raw=0, tol=1e-9):
+        """
+        Set all ECMs at once with given matvalues, an array of
+            (conditions, size, size).
+        If raw == 0, matvalues should contain ratios, and the sum of each
+            column should be 1.0 (within tol).
+        If raw == 1, matvalues should contain raw numbers (e.g., numbers of
+            participants), and they are converted into ratios by dividing
+            each column by its sum.
+        Validation and normalization are performed for all ECMs at once, and
+            all ECMs are installed with a single copy (self.ECM_stack, and
+            each ECM's matrix is a view of it).
+        Failed (condition, column) pairs are stored in self.ECM_error.
+        If the shape of matvalues is not (conditions, size, size), returns
+            -10 (error)
+        If the sum of any column is not 1.0, returns -11 (error)
+        If any element is negative, returns -12 (error)
+        If the sum of any column of raw numbers is 0, returns -13 (error)
+        If successful, returns 1.
+        """
+        self.ECM_error = []
+        # one copy of all ECMs
+        stack = np.array(matvalues,dtype=float)
+
+        # shape should match
+        if stack.shape != (self.conditions,self.size,self.size):
+            return -10
+
+        # no negative ratio or number
+        failed = np.argwhere(np.any(stack < 0,axis=1))
+        if len(failed) > 0:
+            self.ECM_error = [(int(x[0]),int(x[1])) for x in failed]
+            return -12
+
+        col_sum = np.sum(stack,axis=1)
+        if raw:
+            # raw numbers -> ratios
+            failed = np.argwhere(col_sum == 0)
+            if len(failed) > 0:
+                self.ECM_error = [(int(x[0]),int(x[1])) for x in failed]
+                return -13
+            stack /= col_sum[:,None,:]
+        else:
+            # the sum of each column should be 1
+            failed = np.argwhere(np.abs(col_sum-1.0) > tol)
+            if len(failed) > 0:
+                self.ECM_error = [(int(x[0]),int(x[1])) for x in failed]
+                return -11
+
+        # install (in the precision of this class, the float64 copy is kept
+        # for lower precisions)
+        low = stack if self.dtype == np.float64 else stack.astype(self.dtype)
+        for i in range(self.conditions):
+            self.ECM[i].dtype = self.dtype
+            self.ECM[i].matrix = low[i]
+            self.ECM[i].matrix64 = None if low is stack else stack[i]
+            # raw numbers are kept for posterior sampling
+            self.ECM[i].counts = np.array(matvalues[i],dtype=float) if raw else None
+            self.ECM[i].sparse = ''
+            self.ECM[i].has_value = 1
+            if self.sparse:
+                self.ECM[i].setsparse(self.sparse)
+        if not self.sparse:
+            self.ECM_stack = low
+        # cached products are no longer valid
+        self.period_cache = {}
+        self.prefix_cache = 0
+        return 1
+
     def set_t0(self, t0):
         """
         Set the initial participant states at t0
@@ -263,7 +415,7 @@ class Markov_learning(object):
             # first trial
             t_next = self.ECM[condition].evolution_t1(self.status_t0)
             # error occured?
-            if t_next == None:
+            if t_next is None:
                 return -2
             # ok
             for i in range(self.size):
@@ -275,7 +427,7 @@ class Markov_learning(object):
             # send the current status
             t_next = self.ECM[condition].evolution_t1(self.status_t_now[num_schedule][self.t_now-1])
             # error occured?
-            if t_next == None:
+            if t_next is None:
                 return -3
             # ok
             for i in range(self.size):
@@ -295,8 +447,10 @@ class Markov_learning(object):
             (error, length does not match)
         If a certain intervention component (i) in a given intervention
             schedule exceeds the preset number of different types of
-            intervention conditions (self.conditions), returns -3 (error,
-            intervention type number out of boundary)
+            intervention conditions (self.conditions), or is negative,
+            returns -3 (error, intervention type number out of boundary)
+        If schedules were generated by a schedule family, they are
+            materialized first.
         If successful, returns 1
         """
         # if num_schedules out of boundary? error
@@ -308,14 +462,71 @@ class Markov_learning(object):
             # not idential = error.
             return -2
         # check whether there is any input out of the boundary of preset condition num.
-        for i in range(self.length):
-            if schedule[i] >= self.conditions:
-                return -3
+        schedule = np.asarray(schedule)
+        if np.any(schedule >= self.conditions) or np.any(schedule < 0):
+            return -3
 
         # if everything is okay, then set.
+        if isinstance(self.schedule,sc.Schedule_family):
+            self.schedule = np.asarray(self.schedule).astype(sc.schedule_dtype(self.conditions))
         self.schedule[num_schedule] = schedule
         return 1
 
+    def set_schedule_rle(self, num_schedule, values, runs):
+        """
+        Set an intervention schedule, num_schedule, given as a run-length
+            encoding (values, runs), e.g., [0, 2], [1, 99] -> 0 2 2 ... 2.
+        Error codes are identical to those of set_schedule.
+        If successful, returns 1
+        """
+        return self.set_schedule(num_schedule,sc.decode_rle(values,runs,np.int64))
+
+    def set_schedule_pattern(self, num_schedule, pattern, repeat=0):
+        """
+        Set an intervention schedule, num_schedule, given as a pattern
+            encoding (pattern, repeat), e.g., [1, 0, 2] -> 1 0 2 1 0 2 ...
+            The last repetition is truncated to self.length.
+        If repeat is 0, the pattern is repeated up to self.length.
+        Error codes are identical to those of set_schedule.
+        If successful, returns 1
+        """
+        if repeat <= 0:
+            repeat = -(-self.length // max(1,len(pattern)))
+        return self.set_schedule(num_schedule,sc.decode_pattern(pattern,repeat,self.length,np.int64))
+
+    def set_schedule_family(self, family):
+        """
+        Set all intervention schedules as a schedule family (see
+            Markov_schedule, e.g., sc.Gap_family(0,2,100,50)), generated
+            lazily by evolution processes instead of being stored.
+        self.schedules is set to the number of schedules in the family, and
+            status_t_now is newly allocated.
+        If the length of the family does not match with self.length, returns
+            -1 (error)
+        If the family uses a condition out of boundary (self.conditions),
+            returns -2 (error)
+        If successful, returns 1
+        """
+        if family.length != self.length:
+            return -1
+        if family.maximum >= self.conditions:
+            return -2
+
+        self.schedules = family.count
+        self.schedule = family
+        self.alloc_status()
+        return 1
+
+    def schedule_window(self, subset, start, stop):
+        """
+        Conditions of intervention schedules (subset) from t = start to
+            stop - 1 (len(subset) x (stop - start)). Schedules of a schedule
+            family are generated on demand.
+        """
+        if isinstance(self.schedule,sc.Schedule_family):
+            return self.schedule.window(subset,start,stop)
+        return np.asarray(self.schedule)[subset,start:stop]
+
     def evolution_all(self, num_schedule):
         """
         Perform evolution from t = 0 to self.length for a given intervention
@@ -327,6 +538,7 @@ class Markov_learning(object):
         If there is no available schedule, returns -3 (error)
         If self.status_t0, participant states at t0, was not set, returns
             -4 (error)
+        If the output sink fails to write the result, returns -6 (error)
         If successful, returns 1
         """
         # calculate evolved, predicted values for t1 to t_end
@@ -343,15 +555,19 @@ class Markov_learning(object):
             return -3
 
         # if no current status -> error
-        if self.status_t0 == 0:
+        if not np.any(self.status_t0):
             return -4
 
         # clear current t
         self.t_now = 0
 
         # evolution start
+        now = self.schedule[num_schedule]
+        total = np.sum(self.status_t0,dtype=np.float64)
         for i in range(self.length):
-            self.evol_next(num_schedule, int(self.schedule[num_schedule][i]))
+            self.evol_next(num_schedule, int(now[i]))
+            if (self.renormalize > 0) and ((i+1) % self.renormalize == 0):
+                self.renormalize_state(self.status_t_now[num_schedule][i],total)
 
         # evolution for this schedule completed
         self.comp_evol[num_schedule] = 1
@@ -359,11 +575,986 @@ class Markov_learning(object):
         # comparison not completed
         self.comp_done = 0
 
-        # create csv file containing all the things
-        # csv name should be the schedule number.
-        output = np.asarray(self.status_t_now[num_schedule])
-        np.savetxt("%d.csv" % (num_schedule),output,delimiter=",")
-        
+        # pass the result to the output sink
+        # (by default, a csv file named after the schedule number)
+        if self.sink.write(num_schedule,self.status_t_now[num_schedule]) < 0:
+            return -6
+
+        return 1
+
+    def set_sink(self, sink):
+        """
+        Set the output sink receiving participant states of evolved schedules.
+        See Markov_sink for available sinks (e.g., Null_sink for no output,
+            NPY_sink for one binary file, Thread_sink for background writes).
+        The previous sink is closed.
+        If successful, returns 1
+        """
+        self.sink.close()
+        self.sink = sink
+        return 1
+
+    def save_output(self, subset=None):
+        """
+        Pass participant states of evolved schedules to the output sink.
+        subset: list of schedule numbers. If None, all schedules.
+        If any schedule number is out of boundary, returns -1 (error)
+        If evolution for any schedule was not completed, returns -2 (error)
+        If the output sink fails to write, returns -3 (error)
+        If successful, returns 1
+        """
+        # which schedules?
+        if subset is None:
+            subset = np.arange(self.schedules)
+        subset = np.asarray(subset,dtype=int).reshape(-1)
+
+        # schedule numbers should be in the boundary
+        if np.any(subset < 0) or np.any(subset >= self.schedules):
+            return -1
+        # evolution completed?
+        if np.any(self.comp_evol[subset] == 0):
+            return -2
+
+        error = 0
+        for i in subset:
+            if self.sink.write(i,self.status_t_now[i]) < 0:
+                error = 1
+        if (self.sink.flush() < 0) or error:
+            return -3
+        return 1
+
+    def close_sink(self):
+        """
+        Flush and close the output sink. Should be called once all outputs
+            are written, when the sink buffers outputs (e.g., NPY_sink).
+        If successful, returns 1
+        """
+        return self.sink.close()
+
+    def set_sparse(self, sparse):
+        """
+        Store all ECMs as scipy.sparse matrices of a given format ('csr' or
+            'csc'), or as dense matrices again ('').
+        For large state spaces with banded or sparse transitions, evolution
+            processes then use sparse mat-vec products, O(nnz) instead of
+            O(size^2).
+        If the format is not valid, returns -1 (error)
+        If successful, returns 1
+        """
+        if sparse not in ('','csr','csc'):
+            return -1
+        for i in range(self.conditions):
+            self.ECM[i].setsparse(sparse)
+        self.sparse = sparse
+        return 1
+
+    def set_precision(self, dtype, renormalize=0):
+        """
+        Set the precision of ECMs, participant states (status_t_now) and
+            comp_mat. dtype: np.float64 (default) or np.float32 (or their
+            names). float32 halves memory and bandwidth, with about 1e-7
+            relative rounding error per step.
+        renormalize: if > 0, participant states are rescaled every
+            renormalize steps (e.g., 100) so that the number of all
+            participants stays that of status_t0. Column-stochastic ECMs
+            preserve it, but rounding errors accumulate over long horizons.
+        ECMs are converted (float64 copies are kept for precision_check),
+            and status_t_now is newly allocated if schedules are set, so
+            evolution processes should be performed (again) afterwards.
+        If the precision is not valid, returns -1 (error)
+        If renormalize is negative, returns -2 (error)
+        If successful, returns 1
+        """
+        dtype = em.precision_of(dtype)
+        if dtype is None:
+            return -1
+        if renormalize < 0:
+            return -2
+
+        for i in range(len(self.ECM)):
+            self.ECM[i].setdtype(dtype)
+        self.dtype = dtype
+        self.renormalize = int(renormalize)
+        # stacked ECMs and cached products are no longer valid
+        self.ECM_stack = []
+        self.period_cache = {}
+        self.prefix_cache = 0
+        if self.schedules > 0:
+            # release the old states first
+            self.status_t_now = []
+            self.alloc_status()
+        self.comp_mat = np.zeros((self.length*2,6),dtype=self.dtype)
+        self.comp_done = 0
+        return 1
+
+    def set_jit(self, jit):
+        """
+        Select the evolution kernel of evolution_batch for small dense ECMs
+            (size up to Markov_jit.MAX_SIZE), which runs all schedules and
+            ts in one call instead of NumPy calls per t.
+        jit: 1 (default) = compiled with Numba if installed (schedules in
+            parallel), otherwise its NumPy version. 2 = NumPy version only.
+            Both give identical results. 0 = no kernel (evol_step per t).
+        The kernel is not used for sparse ECMs or the early stop (tol > 0).
+        If jit is not 0, 1 or 2, returns -1 (error)
+        If successful, returns 1
+        """
+        if jit not in (0,1,2):
+            return -1
+        self.jit = jit
+        return 1
+
+    def renormalize_state(self, state, total):
+        """
+        Rescale participant states (schedules x size, or size) in place, so
+            that the number of all participants is total.
+        Returns the rescaled states.
+        """
+        now = np.sum(state,axis=-1,keepdims=True,dtype=np.float64)
+        state *= (total / now).astype(state.dtype)
+        return state
+
+    def precision_check(self, subset=None):
+        """
+        Compare participant states of evolved schedules (status_t_now) with
+            a reference evolution in float64 with float64 ECMs, e.g., after
+            set_precision('float32').
+        subset: list of schedule numbers to be checked. If None, all
+            schedules are checked.
+        The maximum absolute deviation over all ts and participant states,
+            relative to the number of all participants (sum of status_t0),
+            is stored in self.precision_error.
+        If any schedule number is out of boundary or was not evolved,
+            returns -1 (error)
+        If self.status_t0 was not set, returns -4 (error)
+        If ECMs cannot be stacked (stack_ECM), returns -5 (error)
+        If successful, returns the maximum deviation.
+        """
+        # which schedules?
+        if subset is None:
+            subset = np.arange(self.schedules)
+        subset = np.asarray(subset,dtype=int).reshape(-1)
+        if np.any(subset < 0) or np.any(subset >= self.schedules):
+            return -1
+        if not np.all(np.asarray(self.comp_evol)[subset]):
+            return -1
+        if not np.any(self.status_t0):
+            return -4
+        if self.stack_ECM() < 0:
+            return -5
+
+        # float64 ECMs
+        stack = [self.ECM[c].reference() for c in range(self.conditions)]
+        if not self.sparse:
+            stack = np.array(stack)
+        total = np.sum(self.status_t0,dtype=np.float64)
+
+        # reference evolution, compared step by step
+        state = np.tile(np.asarray(self.status_t0,dtype=np.float64),(len(subset),1))
+        error = 0.0
+        for begin in range(0,self.length,sc.WINDOW):
+            cond = self.schedule_window(subset,begin,min(begin+sc.WINDOW,self.length))
+            for i in range(cond.shape[1]):
+                state = self.evol_step(cond[:,i],state,stack)
+                now = np.asarray(self.status_t_now[subset,begin+i],dtype=np.float64)
+                error = max(error,float(np.max(np.abs(now-state))))
+        self.precision_error = error / total
+        return self.precision_error
+
+    def stack_ECM(self):
+        """
+        Stack the matrices of all ECMs into one (conditions, size, size)
+            array, self.ECM_stack, for batched evolution processes.
+        For sparse ECMs (set_sparse), self.ECM_stack is a list of CSR
+            matrices instead.
+        If the matrix of a certain ECM does not match with self.size, returns
+            -1 (error)
+        If successful, returns 1
+        """
+        if self.sparse:
+            return self.stack_ECM_sparse()
+
+        # stack all ECMs, condition 0 to self.conditions - 1
+        stack = np.zeros((self.conditions,self.size,self.size),dtype=self.dtype)
+        for i in range(self.conditions):
+            # size should match
+            if np.shape(self.ECM[i].matrix) != (self.size,self.size):
+                return -1
+            stack[i] = self.ECM[i].matrix
+
+        # cached period products are no longer valid if any ECM was changed
+        if not np.array_equal(stack,self.ECM_stack):
+            self.period_cache = {}
+            self.prefix_cache = 0
+        self.ECM_stack = stack
+        return 1
+
+    def stack_ECM_sparse(self):
+        """
+        stack_ECM for sparse ECMs. self.ECM_stack becomes a list of CSR
+            matrices.
+        Return values are identical to those of stack_ECM.
+        """
+        import scipy.sparse as sp
+        stack = []
+        for i in range(self.conditions):
+            now = sp.csr_matrix(self.ECM[i].matrix,dtype=self.dtype)
+            # size should match
+            if now.shape != (self.size,self.size):
+                return -1
+            stack.append(now)
+
+        # cached products are no longer valid if any ECM was changed
+        old = self.ECM_stack
+        same = isinstance(old,list) and (len(old) == len(stack))
+        for i in range(len(stack)):
+            if (not same) or (not sp.issparse(old[i])) or ((old[i] != stack[i]).nnz > 0):
+                same = False
+                break
+        if not same:
+            self.period_cache = {}
+            self.prefix_cache = 0
+        self.ECM_stack = stack
+        return 1
+
+    def evol_step(self, cond_t, state, stack=None):
+        """
+        Perform one batched evolution step, from t to t+1.
+        cond_t contains the intervention condition of each schedule at t, and
+            state contains the participant states of each schedule at t
+            (schedules x size).
+        self.ECM_stack should have been created previously (stack_ECM),
+            unless other stacked ECMs are given (stack).
+        Returns the participant states at t+1 (schedules x size).
+        """
+        if stack is None:
+            stack = self.ECM_stack
+        # schedules sharing the same condition are multiplied together
+        t_next = np.empty_like(state)
+        for c in range(self.conditions):
+            now = (cond_t == c)
+            if np.any(now):
+                if self.sparse:
+                    # sparse mat-vec products
+                    t_next[now] = stack[c].dot(state[now].T).T
+                else:
+                    t_next[now] = np.dot(state[now],stack[c].T)
+        return t_next
+
+    def evolution_batch(self, subset=None, chunk=0, tol=0):
+        """
+        Perform evolution from t = 0 to self.length for all intervention
+            schedules at once.
+        All ECMs are stacked into one array, and all schedules are evolved
+            together with a single vectorized step per t.
+        subset: list of schedule numbers to be evolved. If None, all schedules
+            are evolved.
+        chunk: how many schedules are evolved together. Each chunk is
+            written into status_t_now as one block, so that a memory-mapped
+            store (set_trajectory_store) is written chunk by chunk. If 0, all
+            schedules in memory, or chunks of about 64MB for a store.
+        tol: if > 0, a periodic schedule stops evolving once its states
+            differ from those one period earlier by at most tol (relative to
+            the number of all participants), and the rest of its states are
+            filled by repeating its last period. Schedules without any
+            repetition (detect_period) are always evolved to the end.
+        If any schedule number in subset exceeds the current boundary of
+            intervention schedule numbers (self.schedules), returns -1 (error)
+        If subset is empty, returns -2 (error)
+        If there is no available schedule, returns -3 (error)
+        If self.status_t0, participant states at t0, was not set, returns
+            -4 (error)
+        If ECMs cannot be stacked (stack_ECM), returns -5 (error)
+        Unlike evolution_all, nothing is passed to the output sink (see
+            save_output).
+        If successful, returns 1
+        """
+        # which schedules?
+        if subset is None:
+            subset = np.arange(self.schedules)
+        subset = np.asarray(subset,dtype=int).reshape(-1)
+
+        # schedule numbers should be in the boundary
+        if np.any(subset < 0) or np.any(subset >= self.schedules):
+            return -1
+        # nothing to evolve -> error
+        if len(subset) == 0:
+            return -2
+
+        # if current schedule is empty -> error
+        if (self.length == 0) or (len(self.schedule) == 0):
+            return -3
+
+        # if no current status -> error
+        if not np.any(self.status_t0):
+            return -4
+
+        # stack ECMs
+        if self.stack_ECM() < 0:
+            return -5
+
+        # memory-mapped store? then buffer each chunk and write it at once
+        mapped = isinstance(self.status_t_now,np.memmap)
+        if chunk <= 0:
+            if mapped:
+                chunk = max(1,int((64 << 20) / (self.length * self.size * 8)))
+            else:
+                chunk = len(subset)
+
+        # number of all participants (renormalisation)
+        total = np.sum(self.status_t0,dtype=np.float64)
+        renormalize = self.renormalize
+
+        # periods for the early stop
+        if tol > 0:
+            period = np.array([self.detect_period(i) for i in subset])
+            tol = tol * np.sum(self.status_t0)
+
+        # small dense ECMs: the whole chunk in one kernel call (Markov_jit)
+        kernel = (self.jit > 0) and (not self.sparse) and (tol <= 0) and (self.size <= mj.MAX_SIZE)
+
+        for start in range(0,len(subset),chunk):
+            now = subset[start:start+chunk]
+            # all schedules start from t0
+            state = np.tile(np.asarray(self.status_t0,dtype=self.dtype),(len(now),1))
+            if mapped:
+                out = np.empty((len(now),self.length,self.size),dtype=self.dtype)
+                buffer, rows = out, np.arange(len(now))
+            else:
+                buffer, rows = self.status_t_now, now
+            if kernel:
+                if mapped or np.all(np.diff(now) == 1):
+                    # consecutive schedules are written in place
+                    target = out if mapped else self.status_t_now[now[0]:now[-1]+1]
+                else:
+                    target = np.empty((len(now),self.length,self.size),dtype=self.dtype)
+                # intervention conditions are generated window by window
+                for begin in range(0,self.length,sc.WINDOW):
+                    end = min(begin+sc.WINDOW,self.length)
+                    cond = self.schedule_window(now,begin,end)
+                    mj.evolve(self.ECM_stack,cond,state,target[:,begin:end],renormalize,total,begin,self.jit == 1)
+                if not (mapped or np.all(np.diff(now) == 1)):
+                    self.status_t_now[now] = target
+            else:
+                # schedules still evolving, and t at which each one stopped
+                active = np.ones((len(now)),dtype=bool)
+                stop = np.full((len(now)),self.length-1)
+
+                # evolution start
+                for i in range(self.length):
+                    # intervention conditions are generated window by window
+                    if i % sc.WINDOW == 0:
+                        begin = i
+                        cond = self.schedule_window(now,begin,min(begin+sc.WINDOW,self.length))
+                    if active.all():
+                        state = self.evol_step(cond[:,i-begin],state)
+                        if (renormalize > 0) and ((i+1) % renormalize == 0):
+                            self.renormalize_state(state,total)
+                        buffer[rows,i] = state
+                    else:
+                        state[active] = self.evol_step(cond[active,i-begin],state[active])
+                        if (renormalize > 0) and ((i+1) % renormalize == 0):
+                            state[active] = self.renormalize_state(state[active],total)
+                        buffer[rows[active],i] = state[active]
+                    if tol <= 0:
+                        continue
+
+                    # converged? compare with the states one period earlier, at
+                    # the end of each period
+                    p = period[start:start+chunk]
+                    check = np.where(active & (i >= p) & ((i+1) % p == 0))[0]
+                    if len(check) > 0:
+                        diff = np.max(np.abs(state[check]-buffer[rows[check],i-p[check]]),axis=1)
+                        done = check[diff <= tol]
+                        active[done] = False
+                        stop[done] = i
+                        if not np.any(active):
+                            break
+
+                # fill the rest of converged schedules with their last periods
+                for k in np.where(stop < self.length-1)[0]:
+                    rest = np.arange(stop[k]+1,self.length)
+                    buffer[rows[k],rest] = buffer[rows[k],stop[k]-p[k]+1+(rest-stop[k]-1) % p[k]]
+
+            # write this chunk into the store
+            if mapped:
+                self.status_t_now[now] = out
+                self.status_t_now.flush()
+
+        # evolution for these schedules completed
+        self.comp_evol[subset] = 1
+
+        # comparison not completed
+        self.comp_done = 0
+
+        return 1
+
+    def evolution_reduce(self, reducers, subset=None, chunk=0):
+        """
+        Perform evolution from t = 0 to self.length for all intervention
+            schedules (or a subset of them) at once, like evolution_batch, but
+            pass participant states at each t to reducers (see Markov_reducer)
+            instead of storing them in status_t_now.
+        Thus, memory scales with schedules x reducers, not schedules x length
+            x size.
+        reducers: list of reducers (e.g., [mr.Final_reducer(),
+            mr.Threshold_reducer(0,0.5)]).
+        subset: list of schedule numbers to be evolved. If None, all schedules
+            are evolved.
+        chunk: how many schedules are evolved together. If 0, all of them.
+        Results are stored in self.reduced, a dataframe with the column
+            'schedule' and columns of reducers.
+        Error codes are identical to those of evolution_batch.
+        If successful, returns 1
+        """
+        # which schedules?
+        if subset is None:
+            subset = np.arange(self.schedules)
+        subset = np.asarray(subset,dtype=int).reshape(-1)
+
+        # schedule numbers should be in the boundary
+        if np.any(subset < 0) or np.any(subset >= self.schedules):
+            return -1
+        # nothing to evolve -> error
+        if len(subset) == 0:
+            return -2
+
+        # if current schedule is empty -> error
+        if (self.length == 0) or (len(self.schedule) == 0):
+            return -3
+
+        # if no current status -> error
+        if not np.any(self.status_t0):
+            return -4
+
+        # stack ECMs
+        if self.stack_ECM() < 0:
+            return -5
+
+        if chunk <= 0:
+            chunk = len(subset)
+        # intervention conditions are fetched window by window
+        total = np.sum(self.status_t0,dtype=np.float64)
+
+        blocks = []
+        for start in range(0,len(subset),chunk):
+            now = subset[start:start+chunk]
+            # all schedules start from t0
+            state = np.tile(np.asarray(self.status_t0,dtype=self.dtype),(len(now),1))
+            for reducer in reducers:
+                reducer.start(len(now),self.size,self.length)
+
+            # evolution start
+            for begin in range(0,self.length,sc.WINDOW):
+                cond = self.schedule_window(now,begin,min(begin+sc.WINDOW,self.length))
+                for i in range(cond.shape[1]):
+                    state = self.evol_step(cond[:,i],state)
+                    if (self.renormalize > 0) and ((begin+i+1) % self.renormalize == 0):
+                        self.renormalize_state(state,total)
+                    for reducer in reducers:
+                        reducer.update(begin+i,state)
+
+            blocks.append(np.concatenate([now[:,None]]+[reducer.result() for reducer in reducers],axis=1))
+
+        # compact table, one row per schedule
+        names = ['schedule']
+        for reducer in reducers:
+            names = names + reducer.names(self.size)
+        self.reduced = load_pandas().DataFrame(np.concatenate(blocks),columns=names)
+        self.reduced['schedule'] = self.reduced['schedule'].astype(int)
+        return 1
+
+    def evolution_stream(self, schedule, chunk=0, t0=None):
+        """
+        Perform evolution lazily with a generator, for very long or endless
+            intervention schedules. Nothing is stored in status_t_now, and
+            only O(chunk x size) memory is used.
+        schedule: an intervention schedule number (self.schedule), or any
+            iterable of conditions (list, array, generator, ...). An endless
+            iterable yields states forever.
+        chunk: if 0, the generator yields (t, state) per step. If > 0, yields
+            (t, states) per chunk, where states contains participant states
+            at t to t + chunk - 1 (fewer at the end).
+            t follows status_t_now (t = 0 is the state after the first step).
+        t0: participant states to start from. If None, self.status_t0. Pass
+            the last yielded state to continue a previous stream.
+        The generator stops at the end of the schedule, or at a condition out
+            of boundary (self.conditions).
+        If a schedule number is out of boundary, returns -1 (error)
+        If t0 is not given and self.status_t0 was not set, returns -4 (error)
+        If ECMs cannot be stacked (stack_ECM), returns -5 (error)
+        If successful, returns the generator.
+        """
+        # schedule number? then its schedule
+        if np.isscalar(schedule):
+            if (schedule < 0) or (schedule >= self.schedules):
+                return -1
+            if isinstance(self.schedule,sc.Schedule_family):
+                # generated window by window
+                schedule = (c for start, now in self.schedule.windows([schedule]) for c in now[0])
+            else:
+                schedule = np.asarray(self.schedule[schedule]).astype(int)
+
+        # start from t0, if not given
+        if t0 is None:
+            if not np.any(self.status_t0):
+                return -4
+            t0 = self.status_t0
+
+        # stack ECMs
+        if self.stack_ECM() < 0:
+            return -5
+
+        return self.stream(iter(schedule),chunk,np.array(t0,dtype=self.dtype))
+
+    def stream(self, schedule, chunk, state):
+        """
+        Generator used by evolution_stream.
+        """
+        t = 0
+        total = np.sum(state,dtype=np.float64)
+        if chunk > 0:
+            states = np.empty((chunk,self.size),dtype=self.dtype)
+        for condition in schedule:
+            condition = int(condition)
+            if (condition < 0) or (condition >= self.conditions):
+                break
+            state = self.ECM_stack[condition].dot(state)
+            if (self.renormalize > 0) and ((t+1) % self.renormalize == 0):
+                self.renormalize_state(state,total)
+            if chunk <= 0:
+                yield t, state
+            else:
+                states[t % chunk] = state
+                # chunk full? pass it, and start a new one
+                if (t % chunk) == chunk - 1:
+                    yield t - chunk + 1, states
+                    states = np.empty((chunk,self.size),dtype=self.dtype)
+            t = t + 1
+
+        # the rest
+        if (chunk > 0) and (t % chunk) > 0:
+            yield t - (t % chunk), states[:t % chunk]
+
+    def evolution_cached(self, subset=None, max_nodes=0):
+        """
+        Perform evolution from t = 0 to self.length for all intervention
+            schedules (or a subset of them) with the prefix-trie cache
+            (self.prefix_cache).
+        Schedules are inserted into the trie keyed by their condition
+            sequences, so prefixes shared by several schedules (even across
+            calls) are evolved only once.
+        subset: list of schedule numbers to be evolved. If None, all schedules
+            are evolved.
+        max_nodes: memory cap of the cache (maximum number of cached states).
+            Least recently used deep nodes are evicted first. 0 = no cap.
+        Cache statistics can be checked with self.prefix_cache.stats().
+        Participant states are renormalized as evolution_batch
+            (set_precision).
+        Error codes are identical to those of evolution_batch.
+        If successful, returns 1
+        """
+        # which schedules?
+        if subset is None:
+            subset = np.arange(self.schedules)
+        subset = np.asarray(subset,dtype=int).reshape(-1)
+
+        # schedule numbers should be in the boundary
+        if np.any(subset < 0) or np.any(subset >= self.schedules):
+            return -1
+        # nothing to evolve -> error
+        if len(subset) == 0:
+            return -2
+
+        # if current schedule is empty -> error
+        if (self.length == 0) or (len(self.schedule) == 0):
+            return -3
+
+        # if no current status -> error
+        if not np.any(self.status_t0):
+            return -4
+
+        # stack ECMs (the cache is reset if any ECM was changed)
+        if self.stack_ECM() < 0:
+            return -5
+
+        # new cache is required if there is none, or t0 or renormalization
+        # was changed
+        if (self.prefix_cache == 0) or (not np.array_equal(self.prefix_cache.root.state,np.asarray(self.status_t0,dtype=float))) or (self.prefix_cache.renormalize != self.renormalize):
+            self.prefix_cache = pc.Prefix_cache(self.status_t0,max_nodes,self.renormalize)
+        self.prefix_cache.max_nodes = max_nodes
+
+        # evolution start
+        for i in subset:
+            self.prefix_cache.evolve(np.asarray(self.schedule[i]).astype(int),self.ECM_stack,self.status_t_now[i])
+
+        # evolution for these schedules completed
+        self.comp_evol[subset] = 1
+
+        # comparison not completed
+        self.comp_done = 0
+
+        return 1
+
+    def detect_period(self, num_schedule):
+        """
+        Detect the period of an intervention schedule, num_schedule.
+        The period is the smallest p such that the schedule repeats itself
+            every p steps (schedule[t] == schedule[t - p] for all t >= p).
+        A schedule without any repetition has the period of self.length.
+        If num_schedule is out of boundary (self.schedules), returns -1
+            (error)
+        If successful, returns the detected period.
+        """
+        # is schedule number out of the boundary?
+        if (num_schedule < 0) or (num_schedule >= self.schedules):
+            return -1
+
+        now = np.asarray(self.schedule[num_schedule]).astype(int)
+        # find the shortest shift that maps the schedule onto itself
+        # (only shifts matching the first and the last conditions are checked)
+        shifts = np.arange(1,self.length)
+        shifts = shifts[(now[shifts] == now[0]) & (now[self.length-1-shifts] == now[self.length-1])]
+        for p in shifts:
+            if np.array_equal(now[p:],now[:-p]):
+                return int(p)
+        return self.length
+
+    def period_product(self, pattern):
+        """
+        Calculate products of ECMs over one period of an intervention
+            schedule pattern (conditions applied during one period).
+        Results are cached in self.period_cache per pattern.
+            'prefix': prefix[r] is the product over the first r steps of the
+                period (prefix[0] is the identity matrix).
+            'powers': powers[k] is the product over one period raised to the
+                power of 2^k. Calculated on demand by repeated squaring.
+        self.ECM_stack should have been created previously (stack_ECM).
+        Products are dense matrices, even for sparse ECMs.
+        Returns the cached entry.
+        """
+        key = tuple(int(c) for c in pattern)
+        if key in self.period_cache:
+            return self.period_cache[key]
+
+        # products over the first r steps of the period
+        prefix = np.zeros((len(key)+1,self.size,self.size))
+        prefix[0] = np.identity(self.size)
+        for r in range(len(key)):
+            prefix[r+1] = self.ECM_stack[key[r]].dot(prefix[r])
+
+        # the product over a whole period is the first power
+        entry = {'prefix':prefix, 'powers':[prefix[len(key)]]}
+        self.period_cache[key] = entry
+        return entry
+
+    def evolution_periodic(self, num_schedule, steps, period=0):
+        """
+        Calculate participant states of a periodic intervention schedule,
+            num_schedule, after given numbers of evolution steps without
+            evolving step by step.
+        The product of ECMs over one period is calculated once, and the
+            states at t are calculated with cached powers of the product
+            (repeated squaring). Thus, the cost is O(log(steps)) matrix
+            products rather than O(steps).
+        steps: the number of evolution steps (or a list of them). Can be
+            greater than self.length, then the schedule is assumed to keep
+            repeating with its period. The state after self.length steps
+            corresponds to status_t_now[num_schedule][self.length-1].
+            Participant states are renormalized as evolution_batch
+            (set_precision).
+        period: the period of the schedule. If 0, it is detected
+            (detect_period).
+        If num_schedule is out of boundary, if period is out of boundary
+            (< 0 or > self.length), if any number of steps is negative, if
+            self.status_t0 was not set, or if ECMs cannot be stacked, returns
+            None (error)
+        If successful, returns the participant states (len(steps) x size).
+        """
+        # is schedule number out of the boundary?
+        if (num_schedule < 0) or (num_schedule >= self.schedules):
+            return None
+        # period should be in the boundary
+        if (period < 0) or (period > self.length):
+            return None
+        steps = np.asarray(steps,dtype=int).reshape(-1)
+        if np.any(steps < 0):
+            return None
+        # if no current status -> error
+        if not np.any(self.status_t0):
+            return None
+        # stack ECMs
+        if self.stack_ECM() < 0:
+            return None
+
+        # detect the period, if not given
+        if period == 0:
+            period = self.detect_period(num_schedule)
+
+        entry = self.period_product(np.asarray(self.schedule[num_schedule][:period]).astype(int))
+
+        total = np.sum(self.status_t0,dtype=np.float64)
+        result = np.zeros((len(steps),self.size))
+        for i in range(len(steps)):
+            result[i] = self.periodic_state(entry,period,int(steps[i]))
+            # rescaling only multiplies states by scalars, so it is enough to
+            # rescale them as the state at the last rescaled step would be
+            if (self.renormalize > 0) and (steps[i] >= self.renormalize):
+                last = self.periodic_state(entry,period,int(steps[i] - steps[i] % self.renormalize))
+                result[i] *= total / np.sum(last)
+
+        return result
+
+    def periodic_state(self, entry, period, steps):
+        """
+        Participant states after a given number of steps of a periodic
+            schedule (period_product entry), without renormalization.
+        """
+        powers = entry['powers']
+        # q whole periods + r remaining steps
+        q, r = divmod(steps,period)
+        state = np.asarray(self.status_t0,dtype=float)
+        k = 0
+        while q > 0:
+            # more powers needed? square the last one
+            if k == len(powers):
+                powers.append(np.dot(powers[k-1],powers[k-1]))
+            if q & 1:
+                state = np.dot(powers[k],state)
+            q = q >> 1
+            k = k + 1
+        return np.dot(entry['prefix'][r],state)
+
+    def stationary_all(self):
+        """
+        Calculate the stationary distribution of each ECM (ECM_matrix.
+            stationary), i.e., long-run participant states when one condition
+            is applied forever.
+        If any ECM is not set, returns None (error)
+        If successful, returns the distributions (conditions x size), each
+            normalized to sum to 1.0.
+        """
+        result = np.zeros((self.conditions,self.size))
+        for i in range(self.conditions):
+            now = self.ECM[i].stationary()
+            if now is None:
+                return None
+            result[i] = now
+        return result
+
+    def stationary_schedule(self, num_schedule, period=0):
+        """
+        Calculate the stationary distribution of a periodic intervention
+            schedule, num_schedule, i.e., long-run participant states at the
+            beginning of each period.
+        It is the stationary distribution of the product of ECMs over one
+            period (period_product). States within a period follow from it
+            with period_product(...)['prefix'].
+        period: the period of the schedule. If 0, it is detected
+            (detect_period).
+        If num_schedule or period is out of boundary, or if ECMs cannot be
+            stacked, returns None (error)
+        If successful, returns the distribution (size), normalized to sum to
+            1.0.
+        """
+        # is schedule number out of the boundary?
+        if (num_schedule < 0) or (num_schedule >= self.schedules):
+            return None
+        # period should be in the boundary
+        if (period < 0) or (period > self.length):
+            return None
+        # stack ECMs
+        if self.stack_ECM() < 0:
+            return None
+        # detect the period, if not given
+        if period == 0:
+            period = self.detect_period(num_schedule)
+
+        entry = self.period_product(np.asarray(self.schedule[num_schedule][:period]).astype(int))
+        return em.stationary_of(entry['powers'][0])
+
+    def convergence_time(self, num_schedule, epsilon=1e-6, period=0):
+        """
+        Calculate the number of evolution steps required for participant
+            states of a periodic intervention schedule, num_schedule, to get
+            within epsilon (total variation distance between proportions) of
+            its stationary distribution (stationary_schedule), starting from
+            self.status_t0.
+        Steps are counted in whole periods, with cached powers of the period
+            product (ECM_matrix.mixing_steps), so nothing is simulated.
+        period: the period of the schedule. If 0, it is detected
+            (detect_period).
+        If num_schedule or period is out of boundary, if self.status_t0 was
+            not set, or if ECMs cannot be stacked, returns None (error)
+        If states never converge, returns -1
+        If successful, returns the number of steps.
+        """
+        # is schedule number out of the boundary?
+        if (num_schedule < 0) or (num_schedule >= self.schedules):
+            return None
+        # period should be in the boundary
+        if (period < 0) or (period > self.length):
+            return None
+        # if no current status -> error
+        if not np.any(self.status_t0):
+            return None
+        # stack ECMs
+        if self.stack_ECM() < 0:
+            return None
+        # detect the period, if not given
+        if period == 0:
+            period = self.detect_period(num_schedule)
+
+        entry = self.period_product(np.asarray(self.schedule[num_schedule][:period]).astype(int))
+        periods = em.mixing_steps(entry['powers'][0],epsilon,self.status_t0,entry['powers'])
+        if periods < 0:
+            return -1
+        return periods * period
+
+    def evolution_stochastic(self, num_schedule, replicates, seed=None, quantiles=(0.025,0.5,0.975), keep=0, chunk=1000):
+        """
+        Perform stochastic (Monte Carlo) evolution from t = 0 to self.length
+            for a given intervention schedule, num_schedule.
+        Instead of expected numbers (ECM . state), participants in each
+            state (column) move to next states following a multinomial
+            distribution with the column of the ECM at each t.
+            Participant states at t0 are rounded to integers.
+        Replicates are evolved at once along a replicate axis. They are
+            divided into chunks of chunk replicates, and each chunk draws
+            from its own independent stream (numpy.random.Generator spawned
+            from seed). Thus, results are reproducible with the same seed
+            and chunk, and chunks can be evolved separately.
+        Results:
+            self.mc_mean: mean participant states (length x size)
+            self.mc_quantiles: quantiles of participant states
+                (len(quantiles) x length x size)
+            self.mc_replicates: participant states of all replicates
+                (replicates x length x size), only if keep == 1
+        Only participant states at the current t are kept during evolution
+            (replicates x size), unless keep == 1.
+        If num_schedule is out of boundary, returns -1 (error)
+        If replicates or chunk is smaller than 1, returns -2 (error)
+        If self.status_t0 was not set, returns -4 (error)
+        If ECMs cannot be stacked (stack_ECM), returns -5 (error)
+        If successful, returns 1
+        """
+        # is schedule number out of the boundary?
+        if (num_schedule < 0) or (num_schedule >= self.schedules):
+            return -1
+        if (replicates < 1) or (chunk < 1):
+            return -2
+        # if no current status -> error
+        if not np.any(self.status_t0):
+            return -4
+        # stack ECMs
+        if self.stack_ECM() < 0:
+            return -5
+
+        # transition probabilities from each state (rows: from, cols: to)
+        pvals = np.zeros((self.conditions,self.size,self.size))
+        for c in range(self.conditions):
+            if self.sparse:
+                pvals[c] = self.ECM_stack[c].toarray().T
+            else:
+                pvals[c] = self.ECM_stack[c].T
+        pvals = np.clip(pvals,0,None)
+        pvals /= np.sum(pvals,axis=2)[:,:,None]
+
+        # one independent stream per chunk of replicates
+        sizes = [min(chunk,replicates-i) for i in range(0,replicates,chunk)]
+        streams = [np.random.Generator(np.random.PCG64(x)) for x in np.random.SeedSequence(seed).spawn(len(sizes))]
+        t0 = np.rint(np.asarray(self.status_t0,dtype=float)).astype(np.int64)
+        states = [np.tile(t0,(n,1)) for n in sizes]
+
+        quantiles = np.asarray(quantiles,dtype=float).reshape(-1)
+        self.mc_mean = np.zeros((self.length,self.size))
+        self.mc_quantiles = np.zeros((len(quantiles),self.length,self.size))
+        if keep:
+            self.mc_replicates = np.zeros((replicates,self.length,self.size))
+        else:
+            self.mc_replicates = []
+
+        # evolution start
+        schedule = self.schedule[num_schedule]
+        for i in range(self.length):
+            c = int(schedule[i])
+            for k in range(len(sizes)):
+                # (replicates, from, to) -> sum over from
+                states[k] = np.sum(streams[k].multinomial(states[k],pvals[c]),axis=1)
+            now = np.concatenate(states)
+            self.mc_mean[i] = np.mean(now,axis=0)
+            self.mc_quantiles[:,i] = np.quantile(now,quantiles,axis=0)
+            if keep:
+                self.mc_replicates[:,i] = now
+
+        return 1
+
+    def alloc_status(self):
+        """
+        Allocate status_t_now (schedules x length x size) and reset comp_evol.
+        If self.store_path is set, status_t_now is a memory-mapped .npy file
+            at the path (np.memmap). Otherwise, it is kept in memory.
+        If successful, returns 1
+        """
+        if self.store_path != '':
+            self.status_t_now = np.lib.format.open_memmap(self.store_path,mode='w+',dtype=self.dtype,shape=(self.schedules,self.length,self.size))
+        else:
+            self.status_t_now = np.zeros((self.schedules,self.length,self.size),dtype=self.dtype)
+        self.comp_evol=np.zeros((self.schedules))
+        return 1
+
+    def set_trajectory_store(self, path):
+        """
+        Back status_t_now with a memory-mapped .npy file at path, so that
+            participant states of all schedules do not have to fit in memory.
+        If path is '', status_t_now is kept in memory again.
+        If schedules are already set, status_t_now is newly allocated, so
+            evolution processes should be performed (again) afterwards.
+        The store can be reopened later with open_trajectory_store.
+        If successful, returns 1
+        """
+        self.store_path = path
+        if self.schedules > 0:
+            self.alloc_status()
+        return 1
+
+    def open_trajectory_store(self, path, mode='r', regular=0):
+        """
+        Reopen a trajectory store created by set_trajectory_store (or any .npy
+            file of schedules x length x size) without loading it (zero-copy).
+        All schedules in the store are regarded as evolved, so comparisons
+            (create_comp_matrix, comp_all_schedules_t, etc.) can be performed
+            directly. Values are read lazily from the file.
+        mode: 'r' (read only) or 'r+' (evolution processes can update it)
+        regular: if 1, the store is regarded as results of regular
+            intervention schedules (set_regular_schedule), and the last
+            schedule as the control condition.
+        If the file cannot be opened or is not a 3D array, returns -1 (error)
+        If length or size of the stored array does not match with this
+            class (self.length, self.size), returns -2 (error)
+        If self.schedules was set (> 0) and does not match with the number of
+            stored schedules, returns -3 (error)
+        If successful, returns 1
+        """
+        try:
+            status = np.load(path,mmap_mode=mode)
+        except (IOError, ValueError):
+            return -1
+        if np.ndim(status) != 3:
+            return -1
+        if (status.shape[1] != self.length) or (status.shape[2] != self.size):
+            return -2
+        if (self.schedules > 0) and (status.shape[0] != self.schedules):
+            return -3
+
+        self.schedules = status.shape[0]
+        self.status_t_now = status
+        self.store_path = path
+        self.comp_evol = np.ones((self.schedules))
+        self.comp_done = 0
+        if regular:
+            self.regular_schedule = 1
+            self.tresult_regular=np.zeros((self.schedules-1,4))
         return 1
 
     def create_comp_matrix(self, schedule1, schedule2, cond1, cond2):
@@ -415,34 +1606,27 @@ class Markov_learning(object):
         elif (self.comp_evol[schedule2] == 0):
             return -8
 
+        # read participant states of both schedules once
+        # (status_t_now might be a memory-mapped store)
+        status1 = np.asarray(self.status_t_now[schedule1])
+        status2 = np.asarray(self.status_t_now[schedule2])
+
         # now, create the comparison matrix for two conditions
-        for i in range(self.length):
-            # two items per i (schedule x cond)
-            # for schedule 1
-            self.comp_mat[i][0] = i
-            self.comp_mat[i][1] = 0
-            # condition1
-            self.comp_mat[i][2] = self.status_t_now[schedule1][i][cond1]
-            # condition2
-            self.comp_mat[i][3] = self.status_t_now[schedule1][i][cond2]
-            # difference and ratio
-            self.comp_mat[i][4] = self.comp_mat[i][2]-self.comp_mat[i][3]
-            self.comp_mat[i][5] = self.comp_mat[i][2]/self.comp_mat[i][3]
-            # for schedule 2
-            self.comp_mat[i+self.length][0] = i
-            self.comp_mat[i+self.length][1] = 1
-            self.comp_mat[i+self.length][2] = self.status_t_now[schedule2][i][cond1]
-            self.comp_mat[i+self.length][3] = self.status_t_now[schedule2][i][cond2]
-            self.comp_mat[i+self.length][4] = self.comp_mat[i+self.length][2]-self.comp_mat[i][3]
-            self.comp_mat[i+self.length][5] = self.comp_mat[i+self.length][2]/self.comp_mat[i][3]       
+        fill_comp_matrix(self.comp_mat,status1,status2,cond1,cond2)
         # done
         self.comp_done = 1
         return 1
 
-    def comp_mixed(self):
+    def comp_mixed(self, types=-1, start=None):
         """
         Performs mixed effects analysis to compare two conditions,
+        types: which outcome is analyzed. 0 (Y1), 1 (Y2), 2 (Y1-Y2),
+            3 (Y1/Y2) or -1 (all four outcomes).
+        start: starting values of the fit (e.g., params_object of a previous
+            result), to warm-start it. Ignored when types == -1.
+        Results are stored in self.comp_result_y1, _y2, _ydiff and _yratio.
         If comp_mat was not created, returns -1 (error, nothing to analyze)
+        If types is out of boundary (< -1 or > 3), returns -2 (error)
         If successful, returns 1
         """
         # conduct mixed effects model analysis
@@ -450,16 +1634,125 @@ class Markov_learning(object):
         if self.comp_done == 0:
             return -1 # no->error
 
+        # type should be -1-3 (all, y1, y2, y1-y2, y1/y2)
+        if (types < -1) or (types > 3):
+            return -2
+
         # conduct comparison.
         # save result in self.comp_result
-        self.comp_mat_data=pd.DataFrame(self.comp_mat,columns=['T','SCH','Y1','Y2','DIFF','RATIO'])
+        self.comp_mat_data=load_pandas().DataFrame(self.comp_mat,columns=['T','SCH','Y1','Y2','DIFF','RATIO'])
         # statistical analysis for Y1, Y2, Y1-Y2 and Y1/Y2
-        self.comp_result_y1 = sm.MixedLM.from_formula("Y1 ~ SCH", self.comp_mat_data,groups=self.comp_mat_data["T"]).fit()
-        self.comp_result_y2 = sm.MixedLM.from_formula("Y2 ~ SCH", self.comp_mat_data,groups=self.comp_mat_data["T"]).fit()
-        self.comp_result_ydiff = sm.MixedLM.from_formula("DIFF ~ SCH", self.comp_mat_data,groups=self.comp_mat_data["T"]).fit()
-        self.comp_result_yratio = sm.MixedLM.from_formula("RATIO~ SCH", self.comp_mat_data,groups=self.comp_mat_data["T"]).fit() 
+        if types == -1:
+            self.comp_result_y1 = fit_mixed(self.comp_mat_data,0)
+            self.comp_result_y2 = fit_mixed(self.comp_mat_data,1)
+            self.comp_result_ydiff = fit_mixed(self.comp_mat_data,2)
+            self.comp_result_yratio = fit_mixed(self.comp_mat_data,3)
+        elif types == 0:
+            self.comp_result_y1 = fit_mixed(self.comp_mat_data,0,start)
+        elif types == 1:
+            self.comp_result_y2 = fit_mixed(self.comp_mat_data,1,start)
+        elif types == 2:
+            self.comp_result_ydiff = fit_mixed(self.comp_mat_data,2,start)
+        else:
+            self.comp_result_yratio = fit_mixed(self.comp_mat_data,3,start)
         return 1
     
+    def mixed_batch(self, y0, y1):
+        """
+        Closed-form (ANOVA) estimator of the random intercept model
+            Y ~ SCH, groups = T, for balanced designs with exactly two
+            observations per T (SCH = 0: y0, SCH = 1: y1).
+        For this design, REML estimates of statsmodels MixedLM are given by
+            the two-way ANOVA without replication:
+            SCH effect = mean(y1 - y0), residual variance = var(y1 - y0) / 2,
+            group variance = (2 var((y0 + y1) / 2) - residual variance) / 2.
+            If the group variance is negative, it is set to 0 and the
+            residual variance is estimated by OLS.
+        y0 and y1: schedules x length (one model per row)
+        Returns results (schedules x 8). If a model cannot be estimated in
+            closed form (non-finite values, no variance), its row is NaN.
+            [:,0] intercept
+            [:,1] SCH effect
+            [:,2] standard error of the SCH effect
+            [:,3] z-value of the SCH effect
+            [:,4] p-value of the SCH effect
+            [:,5] group (T) variance
+            [:,6] residual variance (scale)
+            [:,7] 0 (closed form), 1 (statsmodels fallback)
+        """
+        y0 = np.asarray(y0,dtype=float)
+        y1 = np.asarray(y1,dtype=float)
+        n = y0.shape[1]
+        result = np.zeros((len(y0),8))
+
+        d = y1-y0
+        m = (y0+y1)/2.0
+        # sums of squares: interaction (residual) and T (groups)
+        ss_res = np.sum((d-np.mean(d,axis=1)[:,None])**2,axis=1)/2.0
+        ss_grp = 2.0*np.sum((m-np.mean(m,axis=1)[:,None])**2,axis=1)
+        scale = ss_res/(n-1)
+        group = (ss_grp/(n-1)-scale)/2.0
+
+        # negative group variance -> boundary, OLS residual variance
+        bound = group < 0
+        group[bound] = 0.0
+        scale[bound] = (ss_res[bound]+ss_grp[bound])/(2*n-2)
+
+        result[:,0] = np.mean(y0,axis=1)
+        result[:,1] = np.mean(d,axis=1)
+        with np.errstate(divide='ignore',invalid='ignore'):
+            # var(SCH effect) = 2 scale / n (+ group variance, if bound)
+            result[:,2] = np.sqrt(2.0*scale/n)
+            result[:,3] = result[:,1]/result[:,2]
+        result[:,4] = 2.0*load_scipy().norm.sf(np.abs(result[:,3]))
+        result[:,5] = group
+        result[:,6] = scale
+
+        # cannot be estimated in closed form
+        fail = ~np.all(np.isfinite(result),axis=1) | (scale <= 0)
+        result[fail] = np.nan
+        return result
+
+    def comp_mixed_fast(self, types):
+        """
+        Performs mixed effects analysis of comp_mixed for one outcome with a
+            closed-form estimator (mixed_batch) instead of iterative REML,
+            when comp_mat is balanced (one SCH = 0 and one SCH = 1 observation
+            per T, as created by create_comp_matrix).
+        If not balanced (or not possible to estimate in closed form),
+            statsmodels MixedLM is used (comp_mixed).
+        types: 0 (Y1), 1 (Y2), 2 (Y1-Y2), 3 (Y1/Y2)
+        Results are stored in self.fastresult (see mixed_batch).
+        If comp_mat was not created, returns -1 (error, nothing to analyze)
+        If types is out of boundary (< 0 or > 3), returns -2 (error)
+        If successful, returns 1
+        """
+        # comp_matrix should exist
+        if self.comp_done == 0:
+            return -1
+        if (types < 0) or (types > 3):
+            return -2
+
+        # balanced? the first half SCH = 0, the second half SCH = 1,
+        # identical Ts in both halves, and all Ts are different
+        n = self.length
+        T = self.comp_mat[:n,0]
+        balanced = np.all(self.comp_mat[:n,1] == 0) and np.all(self.comp_mat[n:,1] == 1) and np.array_equal(T,self.comp_mat[n:,0]) and (len(np.unique(T)) == n)
+
+        if balanced:
+            result = self.mixed_batch(self.comp_mat[None,:n,types+2],self.comp_mat[None,n:,types+2])[0]
+            if np.all(np.isfinite(result)):
+                self.fastresult[:] = result
+                return 1
+
+        # fallback
+        error = self.comp_mixed(types)
+        if error < 0:
+            return error
+        fit = getattr(self,['comp_result_y1','comp_result_y2','comp_result_ydiff','comp_result_yratio'][types])
+        self.fastresult[:] = mixed_summary(fit)
+        return 1
+
     def comp_r_test(cond):
         """
         Regression analysis is not implemented currently. Not for use.
@@ -504,6 +1797,7 @@ class Markov_learning(object):
             self.tgroup2[i] = self.comp_mat[i+self.length][cond+2]
 
         # conduct comparison.
+        load_statsmodels()
         tr = ss.weightstats.ttest_ind(self.tgroup1, self.tgroup2, alternative='two-sided')
         # t-value
         self.tresult[0] = tr[0]
@@ -525,7 +1819,74 @@ class Markov_learning(object):
         # according to the number of total comparisons -> depends on the number of all schedules.
         return 1
 
-    def comp_all_schedules_mixed(self,cond1,cond2, types):
+    def comp_groups(self, status, control, cond1, cond2, types):
+        """
+        Create the two groups compared by t-tests for many schedules at once,
+            identical to those created by create_comp_matrix and comp_t_test.
+        status: participant states of compared schedules (schedules x length
+            x size), control: participant states of the control schedule
+            (length x size)
+        types: 0 (cond1), 1 (cond2), 2 (cond1 - cond2), 3 (cond1 / cond2)
+        Returns group1 (schedules x length) and group2 (schedules x length).
+        """
+        if types == 0:
+            group1 = status[:,:,cond1]
+            group2 = np.broadcast_to(control[:,cond1],group1.shape)
+        elif types == 1:
+            group1 = status[:,:,cond2]
+            group2 = np.broadcast_to(control[:,cond2],group1.shape)
+        # as in create_comp_matrix, cond2 of the compared schedule is used
+        # for the control schedule's difference and ratio
+        elif types == 2:
+            group1 = status[:,:,cond1]-status[:,:,cond2]
+            group2 = control[:,cond1]-status[:,:,cond2]
+        else:
+            group1 = status[:,:,cond1]/status[:,:,cond2]
+            group2 = control[:,cond1]/status[:,:,cond2]
+        return group1, group2
+
+    def t_test_batch(self, group1, group2):
+        """
+        Conduct the t-tests of comp_t_test for many pairs of groups at once.
+        group1 and group2: schedules x length
+        Returns results (schedules x 4), identical to those of comp_t_test.
+            [:,0], tvalue
+            [:,1], pvalue
+            [:,2] Sidak's corrected pvalue
+            [:,3] Cohen's D effect size
+        """
+        # contiguous rows are required for identical rounding
+        group1 = np.ascontiguousarray(group1)
+        group2 = np.ascontiguousarray(group2)
+        n1 = group1.shape[1]
+        n2 = group2.shape[1]
+        result = np.zeros((len(group1),4))
+
+        # pooled two-sided t-test, as statsmodels ttest_ind
+        # sums are dot products with ones per schedule (stacked 1 x length
+        # rows), so that they are rounded exactly as in statsmodels
+        ones1 = np.ones(n1)
+        ones2 = np.ones(n2)
+        mean1 = np.matmul(group1[:,None,:],ones1)[:,0]/n1
+        mean2 = np.matmul(group2[:,None,:],ones2)[:,0]/n2
+        ss1 = np.matmul(((group1-mean1[:,None])**2)[:,None,:],ones1)[:,0]
+        ss2 = np.matmul(((group2-mean2[:,None])**2)[:,None,:],ones2)[:,0]
+        var_pooled = (ss1+ss2)/(n1-1+n2-1)
+        std_diff = np.sqrt(var_pooled*(1.0/n1+1.0/n2))
+        result[:,0] = (mean1-mean2)/std_diff
+        result[:,1] = load_scipy().t.sf(np.abs(result[:,0]),n1+n2-2)*2
+        # Sidak's correction
+        result[:,2] = 1.0-np.power((1.0-result[:,1]),self.schedules-1.0)
+
+        # Cohen's D calculation, pooled d (see pooled_sd)
+        s1 = np.std(group1,axis=1)
+        s2 = np.std(group2,axis=1)
+        pl = np.sqrt(((n1-1)*s1*s1+(n2-1)*s2*s2)/(n1+n2-2))
+        pl[(s1 <= 0) | (s2 <= 0)] = -1
+        result[:,3] = (np.mean(group1,axis=1)-np.mean(group2,axis=1))/pl
+        return result
+
+    def comp_all_schedules_mixed(self,cond1,cond2, types, workers=1, warm_start=0, fast=0):
         """
         Perform mixed effects analyses.
         DV: cond1 or cond2 or cond1-cond2 or cond1/cond2
@@ -541,7 +1902,22 @@ class Markov_learning(object):
             returns -5 (error)
         If any error occurs while performing actual mixed effects analyses,
             returns -6 (error)
-        Results are stored in self.mixedresult_regular.
+        Only the requested outcome (types) is fitted.
+        workers: number of processes fitting schedules in parallel. 1 = no
+            parallel processing, 0 = as many as CPUs. Worker processes read
+            participant states from a shared memory copy of status_t_now (or
+            from the memory-mapped store, if any). They are spawned, so
+            scripts using workers > 1 should be guarded by
+            if __name__ == '__main__'.
+        warm_start: if 1, each fit starts from estimates of the previous
+            schedule (in parallel processing, the previous schedule handled
+            by the same process).
+        Results are stored in self.mixedresult_regular in schedule order.
+        fast: if 1, all schedules are analyzed at once with the closed-form
+            estimator (mixed_batch), and results are stored in
+            self.fastresult_regular instead (schedules - 1 x 8). statsmodels
+            is used only for schedules not possible to estimate in closed
+            form.
         If successful, returns 1.
         """
         # iterative mixed effects model analysis between two conditions for all schedules
@@ -562,8 +1938,17 @@ class Markov_learning(object):
         if (types < 0) or (types >3):
             return -4 # if not, error
 
+        if fast:
+            return self.comp_all_schedules_mixed_fast(cond1,cond2,types)
+
+        if workers == 0:
+            workers = os.cpu_count()
+        if workers > 1:
+            return self.comp_all_schedules_mixed_parallel(cond1,cond2,types,workers,warm_start)
+
         # temporary comparison matrices
         # from 0 to length/2, create comp matrix
+        start = None
         for i in range(self.schedules-1):
             error = self.create_comp_matrix(i,self.schedules-1,cond1,cond2)
             
@@ -571,7 +1956,7 @@ class Markov_learning(object):
             if error < 0:
                 return -5
 
-            error = self.comp_mixed()
+            error = self.comp_mixed(types,start)
 
             # error occured during mixed effects model test?
             if error <0:
@@ -580,13 +1965,18 @@ class Markov_learning(object):
             # record result
             # according to the type number
             if types == 0:
-                self.mixedresult_regular.append(self.comp_result_y1)
+                result = self.comp_result_y1
             elif types == 1:
-                self.mixedresult_regular.append(self.comp_result_y2)
+                result = self.comp_result_y2
             elif types == 2:
-                self.mixedresult_regular.append(self.comp_result_ydiff)
+                result = self.comp_result_ydiff
             else:
-                self.mixedresult_regular.append(self.comp_result_yratio)
+                result = self.comp_result_yratio
+            self.mixedresult_regular.append(result)
+
+            # next fit starts from this one?
+            if warm_start:
+                start = result.params_object
             
             
 
@@ -596,7 +1986,94 @@ class Markov_learning(object):
             
         return 1
 
-    def comp_all_schedules_t(self, cond1, cond2, types):
+    def comp_all_schedules_mixed_fast(self, cond1, cond2, types):
+        """
+        Closed-form part of comp_all_schedules_mixed. All schedules are
+            compared with the control at once (comp_groups and mixed_batch).
+        If evolution for any schedule was not completed or the comparison
+            matrix cannot be created, returns -5 (error)
+        If any error occurs while fitting fallback models, returns -6 (error)
+        If successful, returns 1
+        """
+        # every comparison matrix should be possible to create
+        if np.any(self.comp_evol == 0):
+            return -5
+        if self.create_comp_matrix(0,self.schedules-1,cond1,cond2) < 0:
+            return -5
+
+        self.fastresult_regular = np.zeros((self.schedules-1,8))
+        control = np.asarray(self.status_t_now[self.schedules-1])
+        # analyze chunks of schedules vs. control at once
+        chunk = max(1,int((64 << 20) / (self.length * self.size * 8)))
+        for start in range(0,self.schedules-1,chunk):
+            end = min(start+chunk,self.schedules-1)
+            status = np.asarray(self.status_t_now[start:end])
+            # schedule (SCH = 0) vs. control (SCH = 1)
+            group1, group2 = self.comp_groups(status,control,cond1,cond2,types)
+            self.fastresult_regular[start:end] = self.mixed_batch(group1,group2)
+
+        # statsmodels for the rest
+        for i in np.where(np.isnan(self.fastresult_regular[:,0]))[0]:
+            self.create_comp_matrix(i,self.schedules-1,cond1,cond2)
+            if self.comp_mixed_fast(types) < 0:
+                return -6
+            self.fastresult_regular[i] = self.fastresult
+        return 1
+
+    def comp_all_schedules_mixed_parallel(self, cond1, cond2, types, workers, warm_start):
+        """
+        Parallel part of comp_all_schedules_mixed. Schedules (except the
+            control) are divided into contiguous blocks, and each block is
+            fitted by a worker process (comp_mixed_worker). Workers are
+            spawned, not forked from this process, which may run BLAS or
+            Numba threads.
+        If evolution for any schedule was not completed or the comparison
+            matrix cannot be created, returns -5 (error)
+        If any error occurs while fitting, returns -6 (error)
+        If successful, returns 1
+        """
+        # every comparison matrix should be possible to create
+        if np.any(self.comp_evol == 0):
+            return -5
+        if self.create_comp_matrix(0,self.schedules-1,cond1,cond2) < 0:
+            return -5
+
+        # blocks of schedules. one block per worker for warm starts,
+        # smaller blocks otherwise to balance loads
+        blocks = workers if warm_start else workers * 4
+        blocks = np.array_split(np.arange(self.schedules-1),min(blocks,self.schedules-1))
+
+        # participant states are shared with workers without copying them
+        # per task: the memory-mapped store itself, or a shared memory copy
+        shm = None
+        if isinstance(self.status_t_now,np.memmap) and (self.store_path != ''):
+            source = ('file',self.store_path)
+        else:
+            status = np.asarray(self.status_t_now)
+            shm = shared_memory.SharedMemory(create=True,size=max(1,status.nbytes))
+            shared = np.ndarray(status.shape,dtype=status.dtype,buffer=shm.buf)
+            shared[:] = status
+            source = ('shm',shm.name,status.shape,status.dtype.str)
+
+        tasks = [(source,list(block),self.schedules-1,cond1,cond2,types,warm_start) for block in blocks if len(block) > 0]
+        try:
+            # workers need only module-level functions and the source
+            with cf.ProcessPoolExecutor(max_workers=workers,mp_context=multiprocessing.get_context('spawn')) as pool:
+                results = list(pool.map(comp_mixed_worker,tasks))
+        except Exception:
+            return -6
+        finally:
+            if shm is not None:
+                del shared
+                shm.close()
+                shm.unlink()
+
+        # record results in schedule order
+        for block in results:
+            self.mixedresult_regular.extend(block)
+        return 1
+
+    def comp_all_schedules_t(self, cond1, cond2, types, vectorized=1):
         """
         Conduct comparisons between all scheduels (only available for regular
             intervention schedules) using t-test.
@@ -613,6 +2090,10 @@ class Markov_learning(object):
         If any error occurs while performing actual t-test,
             returns -6 (error)
         T-test results are stored in tresult_regular
+        vectorized: if 1, all schedules are compared at once in chunks of
+            schedules (t_test_batch), without creating comparison matrices
+            per schedule. Results are identical. If 0, schedules are
+            compared one by one (create_comp_matrix and comp_t_test).
         If successful, returns 1.
         """
         # iterative comparisons between two conditions for all schedules
@@ -633,6 +2114,29 @@ class Markov_learning(object):
         if (types < 0) or (types >3):
             return -4 # if not, error
 
+        if vectorized:
+            # every comparison matrix should be possible to create
+            if np.any(self.comp_evol == 0):
+                return -5
+            # the last comparison matrix is left in comp_mat, as before
+            error = self.create_comp_matrix(self.schedules-2,self.schedules-1,cond1,cond2)
+            if error < 0:
+                return -5
+
+            control = np.asarray(self.status_t_now[self.schedules-1])
+            # compare chunks of schedules vs. control at once
+            # (status_t_now might be a memory-mapped store)
+            chunk = max(1,int((64 << 20) / (self.length * self.size * 8)))
+            for start in range(0,self.schedules-1,chunk):
+                end = min(start+chunk,self.schedules-1)
+                status = np.asarray(self.status_t_now[start:end])
+                group1, group2 = self.comp_groups(status,control,cond1,cond2,types)
+                self.tresult_regular[start:end] = self.t_test_batch(group1,group2)
+
+            # the last result is left in tresult, as before
+            self.tresult[:] = self.tresult_regular[self.schedules-2]
+            return 1
+
         # from 0 to length/2, create comp matrix
         for i in range(self.schedules-1):
             error = self.create_comp_matrix(i,self.schedules-1,cond1,cond2)
@@ -676,7 +2180,7 @@ class Markov_learning(object):
             return -4 # if not, error
         return 1
 
-    def set_regular_schedule(self, cond1, cond2):
+    def set_regular_schedule(self, cond1, cond2, tol=0):
         """
         Automatically setup regular intervention schedules with previously
             set parameters.
@@ -688,8 +2192,12 @@ class Markov_learning(object):
             regular schedules, so returns -1 (error)
         If cond1 or cond2 is out of boundary (self.conditions), returns -2
             (error)
-        Automatically create self.schedule arrays according to the rule.
+        Automatically create self.schedule according to the rule, as a
+            schedule family generated lazily (Markov_schedule.Regular_family).
         Automatically perform all evolution processes for all schedules.
+        tol: early stop of converged schedules (see evolution_batch). All
+            regular schedules are periodic, so long horizons are not fully
+            evolved if tol > 0.
         If successful, set self.regular_schedule = 1 and returns 1
         """
         
@@ -706,30 +2214,15 @@ class Markov_learning(object):
             # out of boundary -> error
             return -2
 
-        # initialize schedule list for freq = 1 to length /2
-        self.schedules = int(self.length/2)+1 # +1 for control condition
-        self.schedule = np.zeros((self.schedules,self.length))
-        self.status_t_now = np.zeros((self.schedules,self.length,self.size))
-        self.comp_evol=np.zeros((self.schedules))
-        
-        # fill the gap
-        for i in range(self.schedules-1):
-            for j in range(self.length):
-                # do cond1?
-                if ((j) % (i+1)) == 0:
-                    # yes. do cond1
-                    self.schedule[i][j] = cond1
-                else:
-                    # no. control intervention.
-                    self.schedule[i][j] = cond2
+        # schedules for freq = 1 to length /2, +1 for control condition
+        # (last schedule = all control condition)
+        self.set_schedule_family(sc.Regular_family(cond1,cond2,self.length))
 
-        # last schedule = all control condition.
-        for i in range(self.length):
-            self.schedule[self.schedules-1][i] = cond2
+        # do evolution for all schedules at once
+        self.evolution_batch(tol=tol)
 
-        # do evolution for all schedules
-        for i in range(self.schedules):
-            self.evolution_all(i)
+        # pass results to the output sink, as evolution_all does
+        self.save_output()
 
         # declare t-test result variable (x length/2)
         self.tresult_regular=np.zeros((self.schedules-1,4))
@@ -811,3 +2304,121 @@ class Markov_learning(object):
         # set regular schedule
         self.set_regular_schedule(0,2)
         return 1
+
+
+# functions shared by Markov_learning and its worker processes
+
+def fill_comp_matrix(comp_mat, status1, status2, cond1, cond2):
+    """
+    Fill a comparison matrix (length * 2 x 6) with participant states of two
+        schedules (status1 and status2, length x size) at cond1 and cond2.
+    Columns: T, SCH (0: schedule 1, 1: schedule 2), Y1 (cond1), Y2 (cond2),
+        DIFF (Y1 - Y2) and RATIO (Y1 / Y2).
+    For schedule 2, DIFF and RATIO are calculated with Y2 of schedule 1.
+    """
+    # two items per i (schedule x cond)
+    n = len(status1)
+    # for schedule 1
+    comp_mat[:n,0] = np.arange(n)
+    comp_mat[:n,1] = 0
+    # condition1 and condition2
+    comp_mat[:n,2] = status1[:,cond1]
+    comp_mat[:n,3] = status1[:,cond2]
+    # difference and ratio
+    comp_mat[:n,4] = comp_mat[:n,2]-comp_mat[:n,3]
+    comp_mat[:n,5] = comp_mat[:n,2]/comp_mat[:n,3]
+    # for schedule 2
+    comp_mat[n:,0] = np.arange(n)
+    comp_mat[n:,1] = 1
+    comp_mat[n:,2] = status2[:,cond1]
+    comp_mat[n:,3] = status2[:,cond2]
+    comp_mat[n:,4] = comp_mat[n:,2]-comp_mat[:n,3]
+    comp_mat[n:,5] = comp_mat[n:,2]/comp_mat[:n,3]
+
+def fit_mixed(comp_mat_data, types, start=None):
+    """
+    Fit the mixed effects model (DV ~ SCH, random intercepts for T) of one
+        outcome. types: 0 (Y1), 1 (Y2), 2 (DIFF) or 3 (RATIO).
+    start: starting values of the fit (warm start), if any.
+    Returns the fitted result.
+    """
+    formula = ["Y1 ~ SCH","Y2 ~ SCH","DIFF ~ SCH","RATIO~ SCH"][types]
+    return load_statsmodels().MixedLM.from_formula(formula,comp_mat_data,groups=comp_mat_data["T"]).fit(start_params=start)
+
+def mixed_summary(fit):
+    """
+    Summarize a fitted mixed effects model (DV ~ SCH) in the form of
+        Markov_learning.mixed_batch results.
+    Returns an array of 8 values (the last one is 1, statsmodels).
+    """
+    return np.array([fit.params['Intercept'],fit.params['SCH'],fit.bse['SCH'],
+                     fit.tvalues['SCH'],fit.pvalues['SCH'],fit.cov_re.iloc[0,0],
+                     fit.scale,1.0])
+
+def comp_mixed_worker(task):
+    """
+    Worker process of comp_all_schedules_mixed. Fits the mixed effects
+        models of a block of schedules vs. the control schedule.
+    task: (source, schedules, control, cond1, cond2, types, warm_start).
+        source is ('file', path) for a memory-mapped store, or ('shm', name,
+        shape, dtype) for shared memory.
+    Returns the fitted results in the order of schedules.
+    """
+    source, schedules, control, cond1, cond2, types, warm_start = task
+    shm = None
+    if source[0] == 'file':
+        status = np.load(source[1],mmap_mode='r')
+    else:
+        shm = shared_memory.SharedMemory(name=source[1])
+        status = np.ndarray(source[2],dtype=np.dtype(source[3]),buffer=shm.buf)
+
+    results = []
+    try:
+        length = status.shape[1]
+        comp_mat = np.zeros((length*2,6))
+        status2 = np.array(status[control])
+        start = None
+        for i in schedules:
+            fill_comp_matrix(comp_mat,np.array(status[i]),status2,cond1,cond2)
+            data = load_pandas().DataFrame(comp_mat,columns=['T','SCH','Y1','Y2','DIFF','RATIO'])
+            result = fit_mixed(data,types,start)
+            results.append(result)
+            if warm_start:
+                start = result.params_object
+    finally:
+        if shm is not None:
+            del status
+            shm.close()
+    return results
+
+def load_pandas():
+    """
+    Import pandas on first use.
+    """
+    global pd
+    if pd is None:
+        import pandas
+        pd = pandas
+    return pd
+
+def load_scipy():
+    """
+    Import scipy.stats on first use.
+    """
+    global st
+    if st is None:
+        import scipy.stats
+        st = scipy.stats
+    return st
+
+def load_statsmodels():
+    """
+    Import statsmodels (api and weightstats) on first use.
+    """
+    global sm, ss
+    if sm is None:
+        import statsmodels.api
+        import statsmodels.stats.weightstats
+        ss = statsmodels.stats
+        sm = statsmodels.api
+    return sm
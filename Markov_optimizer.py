@@ -0,0 +1,428 @@
+"""
+Markov optimizer Class v1.0
+This class searches for intervention schedules maximizing a target
+participant state with ECMs of a Markov learning class
+"""
+
+# Markov schedule optimizer class
+# Finds the intervention schedule maximizing the proportion of a target
+# participant state at the end (or its area under the curve), given the
+# maximum number of interventions per condition (budget).
+
+import numpy as np
+import heapq
+
+class Markov_optimizer(object):
+
+    """
+    Attribute description:
+    ML: Markov learning class providing ECMs and participant states at t0
+    ECM_stack: ECMs of ML (conditions x size x size, dense)
+    t0: participant states at t0
+    total: number of all participants (kept during evolution processes)
+    target: participant state (index) to be maximized
+    objective: 'final' (proportion of target at the end of the schedule) or
+        'auc' (sum of proportions of target from t = 1 to the end)
+    budget: maximum number of interventions per condition (-1 = no limit)
+    bound: upper bounds of the target reachable from each participant state
+        within k steps (k x size), calculated by dynamic programming
+    best_schedule: best intervention schedule found by the last search
+    best_score: its objective value
+    evaluated: number of evolution steps calculated by the last search
+        (search_gray: number of scored schedules)
+    top: best schedules found by search_gray, [(score, schedule), ...] from
+        the best one
+    """
+
+    # attributes
+    ML = 0
+    ECM_stack = []
+    t0 = []
+    total = 0
+    target = 0
+    objective = 'final'
+    budget = []
+    bound = []
+    best_schedule = []
+    best_score = 0
+    evaluated = 0
+    top = []
+
+    def __init__(self, ML, target, objective='final'):
+        """
+        Create Markov optimizer class
+        Requires a Markov learning class with ECMs and t0 set, the target
+            participant state, and the objective ('final' or 'auc').
+        No limit is set for any condition at first (see set_budget).
+        """
+        self.ML = ML
+        self.target = target
+        self.objective = objective
+        self.budget = -np.ones((ML.conditions),dtype=int)
+        self.best_schedule = []
+        self.best_score = 0
+        self.evaluated = 0
+        self.top = []
+        self.update()
+
+    def update(self):
+        """
+        Read ECMs and t0 from the Markov learning class again (e.g., after
+            they were changed).
+        If ECMs cannot be stacked, returns -1 (error)
+        If successful, returns 1
+        """
+        if self.ML.stack_ECM() < 0:
+            return -1
+        if self.ML.sparse:
+            self.ECM_stack = np.array([m.toarray() for m in self.ML.ECM_stack])
+        else:
+            self.ECM_stack = np.array(self.ML.ECM_stack)
+        self.t0 = np.asarray(self.ML.status_t0,dtype=float)
+        self.total = np.sum(self.t0)
+        return 1
+
+    def set_budget(self, budget):
+        """
+        Set the maximum number of interventions per condition (a list with
+            one value per condition, -1 = no limit).
+        If the length of budget does not match with the number of conditions,
+            returns -1 (error)
+        If successful, returns 1
+        """
+        if len(budget) != self.ML.conditions:
+            return -1
+        self.budget = np.asarray(budget,dtype=int)
+        return 1
+
+    def check(self, length):
+        """
+        Check whether a search for schedules of a given length is possible.
+        If length is smaller than 1, returns -1 (error)
+        If the target is out of boundary, returns -2 (error)
+        If budgets do not allow any schedule of the length, returns -3 (error)
+        If the objective is not 'final' or 'auc', returns -4 (error)
+        If t0 was not set, returns -5 (error)
+        If successful, returns 1
+        """
+        if length < 1:
+            return -1
+        if (self.target < 0) or (self.target >= self.ML.size):
+            return -2
+        if np.all(self.budget >= 0) and (np.sum(self.budget) < length):
+            return -3
+        if self.objective not in ('final','auc'):
+            return -4
+        if self.total <= 0:
+            return -5
+        return 1
+
+    def make_bound(self, length):
+        """
+        Calculate upper bounds of the target by dynamic programming.
+            bound[0] is the unit vector of the target, and
+            bound[k+1][j] = max over conditions c of (bound[k] . ECM_c)[j].
+        Thus, bound[k] . x is not smaller than the target after any k steps
+            from participant states x (budgets are ignored).
+        For 'auc', bound[k] is replaced by the sum of bound[1] .. bound[k].
+        """
+        allowed = [c for c in range(self.ML.conditions) if self.budget[c] != 0]
+        bound = np.zeros((length+1,self.ML.size))
+        bound[0][self.target] = 1.0
+        for k in range(length):
+            bound[k+1] = np.max(np.dot(bound[k],self.ECM_stack[allowed]),axis=0)
+        if self.objective == 'auc':
+            bound = np.cumsum(bound,axis=0)-bound[0]
+        self.bound = bound
+
+    def evaluate(self, schedule):
+        """
+        Calculate the objective value of a given intervention schedule.
+        Returns the objective value.
+        """
+        state = self.t0
+        score = 0.0
+        for c in schedule:
+            state = np.dot(self.ECM_stack[int(c)],state)
+            score = score + state[self.target] / self.total
+        if self.objective == 'final':
+            score = state[self.target] / self.total
+        return score
+
+    def search_beam(self, length, width=8):
+        """
+        Search for the best schedule of a given length with beam search.
+        At each t, all candidate prefixes are extended by every condition
+            within budgets at once, and the best width prefixes are kept
+            according to their upper bounds (make_bound). Participant states
+            of prefixes are kept, so each extension costs one product.
+        width == 1 is a greedy search. Suitable for long schedules.
+        Results are stored in self.best_schedule and self.best_score.
+        Error codes are identical to those of check.
+        If successful, returns 1
+        """
+        error = self.check(length)
+        if error < 0:
+            return error
+        self.make_bound(length)
+        conditions = self.ML.conditions
+
+        states = self.t0[None,:]
+        acc = np.zeros((1))
+        counts = np.zeros((1,conditions),dtype=int)
+        schedules = np.zeros((1,0),dtype=int)
+        self.evaluated = 0
+
+        for d in range(length):
+            # extend every prefix by every condition
+            nxt = np.einsum('cij,bj->bci',self.ECM_stack,states)
+            self.evaluated = self.evaluated + len(states) * conditions
+            acc_next = acc[:,None] + nxt[:,:,self.target] / self.total
+            # rank by upper bounds
+            rest = length - d - 1
+            key = np.dot(nxt,self.bound[rest]) / self.total
+            if self.objective == 'auc':
+                key = key + acc_next
+            # budgets
+            over = (self.budget >= 0)[None,:] & (counts >= self.budget[None,:])
+            key[over] = -np.inf
+
+            order = np.argsort(-key,axis=None)[:width]
+            order = order[np.isfinite(key.ravel()[order])]
+            b, c = np.unravel_index(order,key.shape)
+            states = nxt[b,c]
+            acc = acc_next[b,c]
+            counts = counts[b].copy()
+            counts[np.arange(len(b)),c] += 1
+            schedules = np.concatenate((schedules[b],c[:,None]),axis=1)
+
+        if self.objective == 'final':
+            scores = states[:,self.target] / self.total
+        else:
+            scores = acc
+        best = int(np.argmax(scores))
+        self.best_schedule = schedules[best]
+        self.best_score = scores[best]
+        return 1
+
+    def search_exact(self, length, width=8):
+        """
+        Search for the best schedule of a given length exactly, with branch
+            and bound.
+        Schedules are searched depth first. Participant states of the current
+            prefix are kept per depth, so each node costs one product.
+            A branch is pruned when its upper bound (make_bound) is not
+            better than the best schedule found so far. The search starts
+            from the result of search_beam (width).
+        Suitable for short schedules (the worst case is conditions^length).
+        Results are stored in self.best_schedule and self.best_score.
+        Error codes are identical to those of check.
+        If successful, returns 1
+        """
+        # initial solution
+        error = self.search_beam(length,width)
+        if error < 0:
+            return error
+        evaluated = self.evaluated
+
+        self.states = np.zeros((length+1,self.ML.size))
+        self.states[0] = self.t0
+        self.acc = np.zeros((length+1))
+        self.counts = np.zeros((self.ML.conditions),dtype=int)
+        self.schedule_now = np.zeros((length),dtype=int)
+        self.evaluated = 0
+        self.branch(0,length)
+        self.evaluated = self.evaluated + evaluated
+        return 1
+
+    def branch(self, d, length):
+        """
+        Recursive part of search_exact. Extends the current prefix of length
+            d by every condition within budgets.
+        """
+        if d == length:
+            if self.objective == 'final':
+                score = self.states[d][self.target] / self.total
+            else:
+                score = self.acc[d]
+            if score > self.best_score:
+                self.best_score = score
+                self.best_schedule = self.schedule_now.copy()
+            return
+
+        # conditions within budgets
+        allowed = [c for c in range(self.ML.conditions) if (self.budget[c] < 0) or (self.counts[c] < self.budget[c])]
+        nxt = np.dot(self.ECM_stack[allowed],self.states[d])
+        self.evaluated = self.evaluated + len(allowed)
+
+        # upper bounds, the most promising condition first
+        rest = length - d - 1
+        acc = self.acc[d] + nxt[:,self.target] / self.total
+        key = np.dot(nxt,self.bound[rest]) / self.total
+        if self.objective == 'auc':
+            key = key + acc
+
+        for k in np.argsort(-key):
+            # cannot be better? prune
+            if key[k] <= self.best_score:
+                continue
+            c = allowed[k]
+            self.counts[c] += 1
+            self.schedule_now[d] = c
+            self.states[d+1] = nxt[k]
+            self.acc[d+1] = acc[k]
+            self.branch(d+1,length)
+            self.counts[c] -= 1
+
+    def make_tail(self, tail):
+        """
+        Calculate row vectors scoring all schedules of the last tail steps at
+            once (conditions^tail x size). For a schedule s of those steps and
+            participant states x before them,
+            final: (row . x) is the target after s
+            auc: (row . x) is the sum of the target over the steps of s
+        Rows are built backward from the end (row' = row . ECM_c, or
+            row' = (e_target + row) . ECM_c for auc), so only
+            conditions^tail row vectors are stored, not matrices.
+        Returns rows and the number of interventions per condition in each
+            schedule (conditions^tail x conditions).
+        """
+        conditions = self.ML.conditions
+        unit = np.zeros((self.ML.size))
+        unit[self.target] = 1.0
+        if self.objective == 'final':
+            rows = unit[None,:]
+        else:
+            rows = np.zeros((1,self.ML.size))
+        for k in range(tail):
+            if self.objective == 'final':
+                rows = np.dot(rows,self.ECM_stack)
+            else:
+                rows = np.dot(rows+unit,self.ECM_stack)
+            # (rows x conditions x size) -> condition at this step first
+            rows = np.transpose(rows,(1,0,2)).reshape(-1,self.ML.size)
+        digits = np.array(np.unravel_index(np.arange(len(rows)),(conditions,)*tail)).reshape(tail,-1)
+        counts = np.zeros((len(rows),conditions),dtype=int)
+        for c in range(conditions):
+            counts[:,c] = np.sum(digits == c,axis=0)
+        return rows, counts, digits.T
+
+    def search_gray(self, length, top=10, block=4096):
+        """
+        Score every possible schedule of a given length (within budgets), and
+            keep the best top schedules in a bounded heap.
+        The last tail steps (conditions^tail <= block) are scored at once with
+            make_tail. Earlier steps (prefix) are enumerated in reflected
+            mixed-radix Gray code order, where consecutive prefixes differ in
+            one step only. Participant states of the prefix are kept per step,
+            and only those after the changed step are recalculated. The last
+            step of the prefix changes most often, so a prefix costs about one
+            product on average.
+        Suitable for short schedules (all conditions^length schedules are
+            scored).
+        Results are stored in self.top, self.best_schedule and
+            self.best_score.
+        Error codes are identical to those of check.
+        If successful, returns 1
+        """
+        error = self.check(length)
+        if error < 0:
+            return error
+        conditions = self.ML.conditions
+        tail = 1
+        while (tail < length) and (conditions ** (tail+1) <= block):
+            tail = tail + 1
+        rows, tail_counts, tail_digits = self.make_tail(tail)
+        # budgets
+        limited = self.budget >= 0
+        prefix = length - tail
+
+        # prefix states and sums of the target (auc), and prefix counts
+        schedule = np.zeros((prefix),dtype=int)
+        states = np.zeros((prefix+1,self.ML.size))
+        states[0] = self.t0
+        acc = np.zeros((prefix+1))
+        counts = np.zeros((conditions),dtype=int)
+        counts[0] = prefix
+        self.evaluated = 0
+        heap = []
+        order = 0
+        changed = 0
+
+        for position in gray_order(prefix,conditions,schedule):
+            # update counts and recalculate states after the changed step
+            if position >= 0:
+                counts = np.bincount(schedule,minlength=conditions)
+                changed = position
+            for t in range(changed,prefix):
+                states[t+1] = np.dot(self.ECM_stack[schedule[t]],states[t])
+                acc[t+1] = acc[t] + states[t+1][self.target] / self.total
+            changed = prefix
+
+            # score all tails
+            scores = np.dot(rows,states[prefix]) / self.total
+            if self.objective == 'auc':
+                scores = scores + acc[prefix]
+            over = np.any(limited[None,:] & (counts[None,:] + tail_counts > self.budget[None,:]),axis=1)
+            scores[over] = -np.inf
+            self.evaluated = self.evaluated + int(np.sum(~over))
+
+            # better than the current top? push
+            if len(heap) >= top:
+                better = np.where(scores > heap[0][0])[0]
+            else:
+                better = np.where(np.isfinite(scores))[0]
+            if len(better) > top:
+                better = better[np.argpartition(-scores[better],top-1)[:top]]
+            for k in better:
+                item = (scores[k],order,np.concatenate((schedule,tail_digits[k])))
+                order = order + 1
+                if len(heap) < top:
+                    heapq.heappush(heap,item)
+                elif item[0] > heap[0][0]:
+                    heapq.heapreplace(heap,item)
+
+        self.top = [(item[0],item[2]) for item in sorted(heap,key=lambda item: (-item[0],item[1]))]
+        if len(self.top) == 0:
+            self.best_schedule = []
+            self.best_score = 0
+            return -3
+        self.best_score, self.best_schedule = self.top[0]
+        return 1
+
+    def install(self, num_schedule):
+        """
+        Set the best schedule found by the last search as an intervention
+            schedule, num_schedule, of the Markov learning class
+            (Markov_learning.set_schedule).
+        If no schedule was found, returns -10 (error)
+        Otherwise, returns the result of set_schedule.
+        """
+        if len(self.best_schedule) == 0:
+            return -10
+        return self.ML.set_schedule(num_schedule,self.best_schedule)
+
+def gray_order(length, conditions, schedule):
+    """
+    Enumerate all schedules of a given length in reflected mixed-radix Gray
+        code order (Knuth, Algorithm 7.2.1.1H). schedule is modified in place.
+    The first schedule is the current schedule (all 0s); yields -1 for it.
+        After that, yields the position changed from the previous schedule.
+        The last position changes most often.
+    """
+    # digit j is position length - 1 - j
+    focus = list(range(length+1))
+    direction = [1] * length
+    yield -1
+    while True:
+        j = focus[0]
+        focus[0] = 0
+        if j == length:
+            return
+        position = length - 1 - j
+        schedule[position] = schedule[position] + direction[j]
+        if (schedule[position] == 0) or (schedule[position] == conditions - 1):
+            direction[j] = -direction[j]
+            focus[j] = focus[j+1]
+            focus[j+1] = j + 1
+        yield position
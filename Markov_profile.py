@@ -0,0 +1,304 @@
+"""
+Markov profile v1.0
+This module implements opt-in profiling of Markov learning classes
+(per-stage timers, call counters, bytes written and peak allocations)
+"""
+
+# Profiling module
+# Methods listed in HOOKS are wrapped with timers only while a profiler is
+# enabled, and the original methods are restored when it is disabled. Thus,
+# there is no overhead at all when profiling is not used.
+#
+# Usage:
+#   import Markov_profile as mp
+#   with mp.profile(memory=1) as prof:
+#       Test.set_regular_schedule(0,2)
+#   print(prof.summary())
+#   prof.save_json('profile.json')
+#   prof.save_trace('trace.json')   (chrome://tracing or Perfetto)
+#
+# Processes created by parallel methods (workers > 1) are not profiled.
+
+import functools
+import importlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+import numpy as np
+
+# (module, class (None = module function), method ('*' = all public
+# methods), stage name (None = class.method), argument counted as bytes
+# written (index, None = nothing))
+HOOKS = [
+    ('ECM_matrix','ECM_matrix','evolution_t1','ECM product',None),
+    ('ECM_matrix','ECM_matrix','setmatrix_ratio',None,None),
+    ('ECM_matrix','ECM_matrix','setmatrix_rawvalue',None,None),
+    ('Markov_learning','Markov_learning','evol_step','ECM product (batched)',None),
+    ('Markov_learning','Markov_learning','evolution_all',None,None),
+    ('Markov_learning','Markov_learning','evolution_batch',None,None),
+    ('Markov_jit',None,'evolve','evolution kernel',None),
+    ('Markov_learning','Markov_learning','evolution_cached',None,None),
+    ('Markov_learning','Markov_learning','evolution_periodic',None,None),
+    ('Markov_learning','Markov_learning','evolution_stochastic',None,None),
+    ('Markov_learning','Markov_learning','evolution_reduce',None,None),
+    ('Markov_learning','Markov_learning','save_output',None,None),
+    ('Markov_learning','Markov_learning','set_regular_schedule',None,None),
+    ('Markov_learning','Markov_learning','create_comp_matrix','comparison matrix',None),
+    ('Markov_learning','Markov_learning','comp_mixed',None,None),
+    ('Markov_learning','Markov_learning','comp_mixed_fast',None,None),
+    ('Markov_learning','Markov_learning','comp_t_test',None,None),
+    ('Markov_learning','Markov_learning','t_test_batch',None,None),
+    ('Markov_learning','Markov_learning','comp_all_schedules_t',None,None),
+    ('Markov_learning','Markov_learning','comp_all_schedules_mixed',None,None),
+    ('Markov_learning',None,'fit_mixed','statsmodels fit',None),
+    ('Markov_sink','CSV_sink','write','sink write (csv)',2),
+    ('Markov_sink','NPY_sink','write','sink write (npy)',2),
+    ('Markov_sink','NPY_sink','flush','sink flush (npy)',None),
+    ('Markov_sink','Parquet_sink','flush','sink flush (parquet)',None),
+    ('Markov_sink','Parquet_sink','write','sink write (parquet)',2),
+    ('Markov_sink','HDF5_sink','write','sink write (hdf5)',2),
+    ('Markov_sink','Thread_sink','write','sink write (queued)',2),
+    ('Markov_comp','Markov_comp','*',None,None),
+]
+
+# currently enabled profiler
+current = None
+# original methods replaced by wrappers: (owner, name, original)
+patched = []
+
+class Profiler(object):
+
+    """
+    Attribute description:
+    stages: statistics per stage name. 'calls', 'time' (inclusive seconds),
+        'self' (seconds except nested stages), 'bytes' (bytes of arrays
+        passed to output sinks) and 'peak' (largest peak of traced
+        allocations during one call, bytes; only if memory is traced)
+    events: completed calls for the trace, (stage, start, duration, thread)
+    callbacks: functions called at the end of every call, as
+        callback(stage, seconds, info), info = {'bytes', 'peak'}
+    memory: whether allocations are traced (tracemalloc). Tracing slows
+        allocations down.
+    """
+
+    def __init__(self, memory=0, callback=None, trace=1):
+        """
+        Create Profiler
+        memory: trace allocations (peak per stage)
+        callback: a function called at the end of every call (see
+            add_callback)
+        trace: keep every call for the trace (save_trace)
+        """
+        self.memory = memory
+        self.trace = trace
+        self.stages = {}
+        self.events = []
+        self.callbacks = []
+        if callback is not None:
+            self.callbacks.append(callback)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def add_callback(self, callback):
+        """
+        Add a function called at the end of every call of instrumented
+            stages, as callback(stage, seconds, info).
+        """
+        self.callbacks.append(callback)
+
+    def enter(self, stage):
+        """
+        Start a stage (called by wrappers).
+        """
+        stack = getattr(self.local,'stack',None)
+        if stack is None:
+            stack = self.local.stack = []
+        entry = [stage,time.perf_counter(),0.0,0,0]
+        if self.memory and tracemalloc.is_tracing():
+            now, peak = tracemalloc.get_traced_memory()
+            if len(stack) > 0:
+                stack[-1][4] = max(stack[-1][4],peak)
+            entry[3] = now
+            tracemalloc.reset_peak()
+        stack.append(entry)
+
+    def exit(self, written=0):
+        """
+        End the current stage (called by wrappers).
+        """
+        end = time.perf_counter()
+        stack = self.local.stack
+        stage, start, children, base, peak = stack.pop()
+        seconds = end - start
+        if len(stack) > 0:
+            stack[-1][2] = stack[-1][2] + seconds
+        # peak allocation of this call
+        used = 0
+        if self.memory and tracemalloc.is_tracing():
+            peak = max(peak,tracemalloc.get_traced_memory()[1])
+            used = peak - base
+            if len(stack) > 0:
+                stack[-1][4] = max(stack[-1][4],peak)
+
+        with self.lock:
+            now = self.stages.get(stage)
+            if now is None:
+                now = self.stages[stage] = {'calls':0, 'time':0.0, 'self':0.0, 'bytes':0, 'peak':0}
+            now['calls'] = now['calls'] + 1
+            now['time'] = now['time'] + seconds
+            now['self'] = now['self'] + seconds - children
+            now['bytes'] = now['bytes'] + written
+            now['peak'] = max(now['peak'],used)
+            if self.trace:
+                self.events.append((stage,start,seconds,threading.get_ident(),written,used))
+        for callback in self.callbacks:
+            callback(stage,seconds,{'bytes':written, 'peak':used})
+
+    def summary(self):
+        """
+        Returns statistics per stage, from the most time consuming stage
+            (exclusive time).
+        """
+        order = sorted(self.stages,key=lambda stage: -self.stages[stage]['self'])
+        return [dict(stage=stage,**self.stages[stage]) for stage in order]
+
+    def save_json(self, path):
+        """
+        Save statistics per stage (summary) into a JSON file.
+        If successful, returns 1
+        """
+        with open(path,'w') as f:
+            json.dump({'stages':self.summary()},f,indent=1)
+        return 1
+
+    def save_trace(self, path):
+        """
+        Save every call into a JSON file in the Chrome trace event format
+            (chrome://tracing, Perfetto).
+        If successful, returns 1
+        """
+        pid = os.getpid()
+        events = []
+        for stage, start, seconds, thread, written, used in self.events:
+            events.append({'name':stage, 'ph':'X', 'pid':pid, 'tid':thread,
+                           'ts':(start-self.origin)*1e6, 'dur':seconds*1e6,
+                           'args':{'bytes':written, 'peak':used}})
+        with open(path,'w') as f:
+            json.dump({'traceEvents':events, 'displayTimeUnit':'ms'},f)
+        return 1
+
+def written_bytes(value):
+    """
+    Bytes of an array (or anything convertible to an array).
+    """
+    if hasattr(value,'nbytes'):
+        return int(value.nbytes)
+    return int(np.asarray(value).nbytes)
+
+def wrap(function, stage, argument):
+    """
+    Wrap a function with the timer of a stage.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profiler = current
+        if profiler is None:
+            return function(*args, **kwargs)
+        profiler.enter(stage)
+        written = 0
+        try:
+            if (argument is not None) and (len(args) > argument):
+                written = written_bytes(args[argument])
+            return function(*args, **kwargs)
+        finally:
+            profiler.exit(written)
+    wrapper.profile_original = function
+    return wrapper
+
+def instrument():
+    """
+    Replace methods listed in HOOKS with wrappers (once).
+    Modules which cannot be imported are skipped.
+    """
+    if len(patched) > 0:
+        return
+    for module_name, class_name, method, stage, argument in HOOKS:
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            continue
+        owner = module if class_name is None else getattr(module,class_name,None)
+        if owner is None:
+            continue
+        if method == '*':
+            names = [name for name in vars(owner) if (not name.startswith('_')) and callable(vars(owner)[name])]
+        else:
+            names = [method] if method in vars(owner) else []
+        for name in names:
+            original = vars(owner)[name]
+            label = stage
+            if label is None:
+                label = '%s.%s' % (class_name or module_name,name)
+            patched.append((owner,name,original))
+            setattr(owner,name,wrap(original,label,argument))
+
+def restore():
+    """
+    Restore all original methods.
+    """
+    while len(patched) > 0:
+        owner, name, original = patched.pop()
+        setattr(owner,name,original)
+
+def enable(profiler):
+    """
+    Enable a profiler (instrument methods, and start tracing allocations if
+        profiler.memory is set).
+    If another profiler is already enabled, returns -1 (error)
+    If successful, returns 1
+    """
+    global current
+    if current is not None:
+        return -1
+    instrument()
+    if profiler.memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        profiler.started = 1
+    current = profiler
+    return 1
+
+def disable():
+    """
+    Disable the current profiler, and restore all original methods.
+    Returns the disabled profiler (None if nothing was enabled).
+    """
+    global current
+    profiler = current
+    current = None
+    restore()
+    if (profiler is not None) and getattr(profiler,'started',0):
+        tracemalloc.stop()
+    return profiler
+
+class profile(object):
+
+    """
+    Context manager enabling a profiler within a with block.
+        with profile(memory=1, callback=None, trace=1) as prof: ...
+    See Profiler for parameters.
+    """
+
+    def __init__(self, memory=0, callback=None, trace=1):
+        self.profiler = Profiler(memory,callback,trace)
+
+    def __enter__(self):
+        if enable(self.profiler) < 0:
+            raise RuntimeError('another profiler is already enabled')
+        return self.profiler
+
+    def __exit__(self, kind, value, traceback):
+        disable()
+        return False
@@ -0,0 +1,177 @@
+"""
+Markov reducer Classes v1.0
+These classes implement reducers summarizing participant states on the fly
+during evolution processes
+"""
+
+# Reducer classes
+# Markov_learning.evolution_reduce passes participant states of evolved
+# schedules (schedules x size) to its reducers at each t, instead of storing
+# them (length x size per schedule). Available reducers:
+#   Final_reducer: participant states at the end
+#   AUC_reducer: area under the curve of each participant state
+#   Threshold_reducer: first t the share of a participant state reaches a
+#       threshold
+#   Window_reducer: means of participant states over a window of ts
+
+import numpy as np
+
+class Null_reducer(object):
+
+    """
+    No statistics. Base class of all reducers.
+    Reducers implement start (schedules, size, length), update (t, state),
+        result () and names (size).
+    """
+
+    def start(self, schedules, size, length):
+        """
+        Prepare statistics for a new block of schedules evolved together.
+        """
+        self.value = np.zeros((schedules,0))
+
+    def update(self, t, state):
+        """
+        Update statistics with participant states at t (schedules x size).
+        """
+        pass
+
+    def result(self):
+        """
+        Returns statistics of the current block (schedules x columns).
+        """
+        return self.value
+
+    def names(self, size):
+        """
+        Returns names of columns of statistics.
+        """
+        return []
+
+class Final_reducer(Null_reducer):
+
+    """
+    Participant states at the end of the schedule (t = length - 1).
+    """
+
+    def start(self, schedules, size, length):
+        """
+        Prepare the final states of a new block of schedules.
+        """
+        self.value = np.zeros((schedules,size))
+
+    def update(self, t, state):
+        """
+        Keep participant states at t (the last one remains).
+        """
+        self.value = state
+
+    def names(self, size):
+        """
+        Returns names of columns, final_S0, final_S1, ...
+        """
+        return ['final_S%d' % (i) for i in range(size)]
+
+class AUC_reducer(Null_reducer):
+
+    """
+    Area under the curve of each participant state, i.e., the sum of
+        participant states from t = 0 to length - 1 (one unit per t).
+    """
+
+    def start(self, schedules, size, length):
+        """
+        Prepare the sums of a new block of schedules.
+        """
+        self.value = np.zeros((schedules,size))
+
+    def update(self, t, state):
+        """
+        Add participant states at t.
+        """
+        self.value += state
+
+    def names(self, size):
+        """
+        Returns names of columns, auc_S0, auc_S1, ...
+        """
+        return ['auc_S%d' % (i) for i in range(size)]
+
+class Threshold_reducer(Null_reducer):
+
+    """
+    Attribute description:
+    state: participant state to be monitored
+    threshold: share of the state among all participants (0 - 1.0)
+    The first t at which the share reaches the threshold (-1 = never).
+    """
+
+    def __init__(self, state, threshold):
+        """
+        Create Threshold reducer
+        """
+        self.state = state
+        self.threshold = threshold
+
+    def start(self, schedules, size, length):
+        """
+        Prepare the first ts of a new block of schedules (-1 = not yet).
+        """
+        self.value = -np.ones((schedules,1))
+
+    def update(self, t, state):
+        """
+        Record t for schedules reaching the threshold for the first time.
+        """
+        reached = state[:,self.state] >= self.threshold * np.sum(state,axis=1)
+        self.value[reached & (self.value[:,0] < 0),0] = t
+
+    def names(self, size):
+        """
+        Returns the name of the column, cross_S(state)_(threshold).
+        """
+        return ['cross_S%d_%g' % (self.state,self.threshold)]
+
+class Window_reducer(Null_reducer):
+
+    """
+    Attribute description:
+    begin, end: window of ts (begin <= t < end)
+    Means of participant states over the window.
+    """
+
+    def __init__(self, begin, end):
+        """
+        Create Window reducer
+        """
+        self.begin = begin
+        self.end = end
+
+    def start(self, schedules, size, length):
+        """
+        Prepare the sums of a new block of schedules.
+        """
+        self.value = np.zeros((schedules,size))
+        # ts actually in the window
+        self.count = max(0,min(self.end,length) - max(self.begin,0))
+
+    def update(self, t, state):
+        """
+        Add participant states at t, if t is in the window.
+        """
+        if self.begin <= t < self.end:
+            self.value += state
+
+    def result(self):
+        """
+        Returns the means over the window (NaN if no t is in the window).
+        """
+        if self.count == 0:
+            return np.full(self.value.shape,np.nan)
+        return self.value / self.count
+
+    def names(self, size):
+        """
+        Returns names of columns, mean_(begin)_(end)_S0, ...
+        """
+        return ['mean_%d_%d_S%d' % (self.begin,self.end,i) for i in range(size)]
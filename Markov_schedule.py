@@ -0,0 +1,256 @@
+"""
+Markov schedule Classes v1.0
+These classes implement compact encodings of intervention schedules and
+lazy families of intervention schedules
+"""
+
+# Schedule classes
+# Intervention schedules are stored as compact unsigned integer arrays
+# (schedule_dtype, one byte per t for up to 256 conditions) instead of
+# float64 arrays. Schedules can also be given as encodings:
+#   run-length: (values, runs), e.g., [0, 2], [1, 3] -> 0 2 2 2
+#   pattern: (pattern, repeat), e.g., [1, 0, 2], 34 -> 1 0 2 1 0 2 ...
+#       (truncated to the length)
+# Families generate their schedules lazily, window by window, so the evolution
+# engine (Markov_learning.evolution_batch, evolution_reduce, etc.) consumes
+# them directly without storing schedules x length conditions:
+#   Schedule_family: schedules applying one condition (e.g., control)
+#   Regular_family: regular schedules (set_regular_schedule, tutorial 1)
+#   Gap_family: schedules with growing gaps between interventions
+#       (tutorial 2)
+#   Cyclic_family: schedules repeating patterns of conditions (tutorial 4)
+# A family behaves like an array of schedules: len(family), family[i] and
+# np.asarray(family) (all schedules, materialized) are available.
+
+import numpy as np
+
+# ts of conditions generated at once by evolution processes
+WINDOW = 4096
+
+def schedule_dtype(conditions):
+    """
+    Smallest unsigned integer type holding condition numbers
+        (0 - conditions - 1).
+    """
+    if conditions <= 256:
+        return np.uint8
+    return np.uint16
+
+def encode_rle(schedule):
+    """
+    Run-length encoding of an intervention schedule.
+    Returns (values, runs): conditions of runs and their lengths.
+    """
+    schedule = np.asarray(schedule).reshape(-1)
+    if len(schedule) == 0:
+        return np.zeros((0),dtype=int), np.zeros((0),dtype=int)
+    starts = np.concatenate(([0],np.where(schedule[1:] != schedule[:-1])[0]+1))
+    runs = np.diff(np.concatenate((starts,[len(schedule)])))
+    return schedule[starts].astype(int), runs
+
+def decode_rle(values, runs, dtype=np.uint8):
+    """
+    Intervention schedule of a run-length encoding (values, runs).
+    """
+    return np.repeat(np.asarray(values,dtype=dtype),np.asarray(runs,dtype=int))
+
+def encode_pattern(schedule):
+    """
+    Pattern encoding of an intervention schedule. The pattern is the
+        shortest one repeating itself over the whole schedule (see
+        Markov_learning.detect_period).
+    Returns (pattern, repeat). The last repetition may be truncated.
+    """
+    schedule = np.asarray(schedule).reshape(-1)
+    length = len(schedule)
+    # only shifts matching the first and the last conditions are checked
+    shifts = np.arange(1,length)
+    shifts = shifts[(schedule[shifts] == schedule[0]) & (schedule[length-1-shifts] == schedule[length-1])]
+    period = length
+    for p in shifts:
+        if np.array_equal(schedule[p:],schedule[:-p]):
+            period = int(p)
+            break
+    return schedule[:period].astype(int), -(-length // max(period,1))
+
+def decode_pattern(pattern, repeat, length=0, dtype=np.uint8):
+    """
+    Intervention schedule of a pattern encoding (pattern, repeat), truncated
+        to length (if > 0).
+    """
+    schedule = np.tile(np.asarray(pattern,dtype=dtype),repeat)
+    if length > 0:
+        schedule = schedule[:length]
+    return schedule
+
+class Schedule_family(object):
+
+    """
+    Attribute description:
+    count: number of schedules in the family
+    length: length of each schedule
+    condition: condition applied by all schedules of this family
+    maximum: the largest condition number used by the family
+    dtype: type of generated conditions (schedule_dtype)
+    Schedules applying one condition only (e.g., control schedules). Base
+        class of all families. Families implement window (rows, start,
+        stop), filling a len(rows) x (stop - start) array in dtype directly.
+    """
+
+    def __init__(self, length, count, condition=0):
+        """
+        Create Schedule family
+        """
+        self.length = length
+        self.count = count
+        self.condition = condition
+        self.maximum = condition
+        self.dtype = schedule_dtype(self.maximum+1)
+
+    def window(self, rows, start, stop):
+        """
+        Conditions of schedules (rows) from t = start to stop - 1
+            (len(rows) x (stop - start)).
+        """
+        return np.full((len(rows),stop-start),self.condition,dtype=self.dtype)
+
+    def block(self, rows=None):
+        """
+        Whole schedules of rows (all schedules if None), len(rows) x length.
+        """
+        if rows is None:
+            rows = np.arange(self.count)
+        return self.window(np.asarray(rows,dtype=int).reshape(-1),0,self.length)
+
+    def windows(self, rows, size=WINDOW):
+        """
+        Generator of (start, conditions) for rows, size ts at a time, so that
+            at most len(rows) x size conditions exist at once.
+        """
+        rows = np.asarray(rows,dtype=int).reshape(-1)
+        for start in range(0,self.length,size):
+            yield start, self.window(rows,start,min(start+size,self.length))
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, num):
+        if (num < -self.count) or (num >= self.count):
+            raise IndexError('schedule number out of range')
+        return self.window(np.array([num % self.count]),0,self.length)[0]
+
+    def __iter__(self):
+        for num in range(self.count):
+            yield self[num]
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.block()
+        if dtype is not None:
+            values = values.astype(dtype)
+        return values
+
+class Regular_family(Schedule_family):
+
+    """
+    Attribute description:
+    cond1: experimental condition
+    cond2: control condition
+    Regular schedules, as set_regular_schedule: schedule i applies cond1
+        every i + 1 ts (from t = 0) and cond2 otherwise (i = 0 to length / 2
+        - 1). The last schedule applies cond2 only.
+    """
+
+    def __init__(self, cond1, cond2, length):
+        """
+        Create Regular family
+        """
+        Schedule_family.__init__(self,length,int(length/2)+1,cond2) # +1 for control condition
+        self.cond1 = cond1
+        self.cond2 = cond2
+        self.maximum = max(cond1,cond2)
+        self.dtype = schedule_dtype(self.maximum+1)
+
+    def window(self, rows, start, stop):
+        """
+        Conditions of schedules (rows) from t = start to stop - 1.
+        """
+        rows = np.asarray(rows,dtype=int).reshape(-1)
+        out = np.full((len(rows),stop-start),self.cond2,dtype=self.dtype)
+        for k, i in enumerate(rows):
+            # the control schedule never applies cond1
+            if i < self.count-1:
+                gap = i + 1
+                out[k,(-start) % gap::gap] = self.cond1
+        return out
+
+class Gap_family(Schedule_family):
+
+    """
+    Attribute description:
+    cond1: experimental condition
+    cond2: control condition
+    first: the gap between the first and the second interventions
+    growth: growth of gaps per schedule number
+    Schedules with growing gaps: schedule i applies cond1 at t = 0, and then
+        after gaps of first, first + growth x i, first + 2 x growth x i, ...
+        (cond2 otherwise). With first = 2 and growth = 1 (tutorial 2),
+        101010101..., 101001000100001..., 101000100000100000001...
+    """
+
+    def __init__(self, cond1, cond2, length, count, first=2, growth=1):
+        """
+        Create Gap family
+        """
+        Schedule_family.__init__(self,length,count,cond2)
+        self.cond1 = cond1
+        self.cond2 = cond2
+        self.first = max(1,first)
+        self.growth = growth
+        self.maximum = max(cond1,cond2)
+        self.dtype = schedule_dtype(self.maximum+1)
+
+    def window(self, rows, start, stop):
+        """
+        Conditions of schedules (rows) from t = start to stop - 1.
+        """
+        rows = np.asarray(rows,dtype=int).reshape(-1)
+        out = np.full((len(rows),stop-start),self.cond2,dtype=self.dtype)
+        m = np.arange(stop // self.first + 1)
+        for k, i in enumerate(rows):
+            # t of the m-th intervention: m x first + growth x i x m (m - 1) / 2
+            t = m * self.first + self.growth * i * (m * (m-1) // 2)
+            t = t[(t >= start) & (t < stop)]
+            out[k,t-start] = self.cond1
+        return out
+
+class Cyclic_family(Schedule_family):
+
+    """
+    Attribute description:
+    patterns: patterns of conditions, one per schedule
+    Schedules repeating their patterns from t = 0 (tutorial 4), e.g.,
+        [[1, 0, 2], [0, 1, 2], [2]] -> 102102..., 012012..., 222...
+    """
+
+    def __init__(self, patterns, length):
+        """
+        Create Cyclic family
+        """
+        self.patterns = [np.asarray(p,dtype=int).reshape(-1) for p in patterns]
+        Schedule_family.__init__(self,length,len(self.patterns))
+        self.maximum = max([int(np.max(p)) for p in self.patterns if len(p) > 0] + [0])
+        self.dtype = schedule_dtype(self.maximum+1)
+        self.patterns = [p.astype(self.dtype) if len(p) > 0 else np.zeros((1),dtype=self.dtype) for p in self.patterns]
+
+    def window(self, rows, start, stop):
+        """
+        Conditions of schedules (rows) from t = start to stop - 1.
+        """
+        rows = np.asarray(rows,dtype=int).reshape(-1)
+        out = np.empty((len(rows),stop-start),dtype=self.dtype)
+        for k, i in enumerate(rows):
+            pattern = self.patterns[i]
+            # the pattern rotated to start, repeated over the window
+            now = np.roll(pattern,-(start % len(pattern)))
+            out[k] = np.resize(now,stop-start)
+        return out
@@ -0,0 +1,331 @@
+"""
+Markov sink Classes v1.0
+These classes implement output sinks for participant states calculated
+during evolution processes
+"""
+
+# Output sink classes
+# Markov_learning passes participant states of each evolved schedule
+# (length x size) to its sink. Available sinks:
+#   Null_sink: no output
+#   CSV_sink: one csv file per schedule (0.csv, 1.csv, ...), as before
+#   NPY_sink: one binary .npy/.npz file containing all schedules
+#   Parquet_sink: chunked Parquet files, partitioned by schedule (pyarrow)
+#   HDF5_sink: one HDF5 file, one chunked dataset per schedule (h5py)
+#   Thread_sink: writes through another sink in a background thread
+
+import os
+import threading
+import queue
+import numpy as np
+
+class Null_sink(object):
+
+    """
+    No output. Base class of all sinks.
+    Sinks implement write (num_schedule, status), flush () and close ().
+    """
+
+    def write(self, num_schedule, status):
+        """
+        Write participant states (length x size) of a schedule, num_schedule.
+        If successful, returns 1
+        """
+        return 1
+
+    def flush(self):
+        """
+        Write out all buffered outputs.
+        If successful, returns 1
+        """
+        return 1
+
+    def close(self):
+        """
+        Flush and close the sink.
+        If successful, returns 1
+        """
+        return self.flush()
+
+class CSV_sink(Null_sink):
+
+    """
+    Attribute description:
+    directory: where csv files are created (current directory by default)
+    Each schedule is written into "(schedule number).csv".
+    """
+
+    def __init__(self, directory = ''):
+        """
+        Create CSV sink
+        """
+        self.directory = directory
+
+    def write(self, num_schedule, status):
+        """
+        Write participant states of a schedule into "(num_schedule).csv".
+        If successful, returns 1
+        """
+        # csv name should be the schedule number.
+        output = np.asarray(status)
+        np.savetxt(os.path.join(self.directory,"%d.csv" % (num_schedule)),output,delimiter=",")
+        return 1
+
+class NPY_sink(Null_sink):
+
+    """
+    Attribute description:
+    path: output file. If it ends with .npz, schedule numbers ('schedules')
+        and participant states ('status', schedules x length x size) are
+        stored. If not, only participant states are stored in a .npy file.
+    status: written participant states, per schedule number (not copied)
+    Everything is written into one binary file when the sink is flushed.
+    """
+
+    def __init__(self, path):
+        """
+        Create NPY sink
+        """
+        self.path = path
+        self.status = {}
+
+    def write(self, num_schedule, status):
+        """
+        Keep participant states of a schedule until the sink is flushed.
+        Status is not copied, so it should not be modified before flushing.
+        If successful, returns 1
+        """
+        self.status[num_schedule] = status
+        return 1
+
+    def flush(self):
+        """
+        Write all kept participant states into the file in the order of
+            schedule numbers.
+        If nothing was written, returns 0
+        If successful, returns 1
+        """
+        if len(self.status) == 0:
+            return 0
+        schedules = np.array(sorted(self.status))
+        output = np.stack([np.asarray(self.status[i]) for i in schedules])
+        if self.path.endswith('.npz'):
+            np.savez(self.path,schedules=schedules,status=output)
+        else:
+            np.save(self.path,output)
+        return 1
+
+class Parquet_sink(Null_sink):
+
+    """
+    Attribute description:
+    directory: where Parquet files are created
+    chunk: how many schedules are written into one Parquet file
+    buffer: participant states (copied) waiting to be written
+    parts: how many Parquet files have been written
+    Each file contains columns 'schedule', 't' and 'S0', 'S1', ... (participant
+        states), and the rows of one schedule form one row group, so a
+        schedule can be read without reading others. Requires pyarrow.
+    """
+
+    def __init__(self, directory, chunk = 1000):
+        """
+        Create Parquet sink
+        """
+        # pyarrow is only required when this sink is used
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.directory = directory
+        self.chunk = chunk
+        self.buffer = []
+        self.parts = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def write(self, num_schedule, status):
+        """
+        Buffer participant states of a schedule. Once self.chunk schedules are
+            buffered, they are written into one Parquet file.
+        If successful, returns 1
+        """
+        self.buffer.append((num_schedule,np.array(status)))
+        if len(self.buffer) >= self.chunk:
+            return self.flush()
+        return 1
+
+    def flush(self):
+        """
+        Write all buffered schedules into a new Parquet file.
+        If nothing was buffered, returns 0
+        If successful, returns 1
+        """
+        if len(self.buffer) == 0:
+            return 0
+        writer = None
+        for num_schedule, status in self.buffer:
+            columns = {'schedule':np.full(len(status),num_schedule),
+                       't':np.arange(len(status))}
+            for i in range(status.shape[1]):
+                columns['S%d' % (i)] = status[:,i]
+            table = self.pa.table(columns)
+            if writer is None:
+                path = os.path.join(self.directory,"part-%05d.parquet" % (self.parts))
+                writer = self.pq.ParquetWriter(path,table.schema)
+            # one row group per schedule
+            writer.write_table(table)
+        writer.close()
+        self.parts = self.parts + 1
+        self.buffer = []
+        return 1
+
+class HDF5_sink(Null_sink):
+
+    """
+    Attribute description:
+    path: output HDF5 file
+    chunk: chunk length (ts) of datasets
+    Participant states of each schedule are stored in a chunked dataset,
+        "schedule_(schedule number)". Requires h5py.
+    """
+
+    def __init__(self, path, chunk = 1024):
+        """
+        Create HDF5 sink
+        """
+        # h5py is only required when this sink is used
+        import h5py
+        self.path = path
+        self.chunk = chunk
+        self.file = h5py.File(path,'a')
+
+    def write(self, num_schedule, status):
+        """
+        Write participant states of a schedule into its dataset.
+        If successful, returns 1
+        """
+        status = np.asarray(status)
+        name = "schedule_%d" % (num_schedule)
+        if name in self.file:
+            del self.file[name]
+        self.file.create_dataset(name,data=status,chunks=(min(self.chunk,len(status)),status.shape[1]))
+        return 1
+
+    def flush(self):
+        """
+        Flush the HDF5 file.
+        If successful, returns 1
+        """
+        self.file.flush()
+        return 1
+
+    def close(self):
+        """
+        Close the HDF5 file.
+        If successful, returns 1
+        """
+        self.file.close()
+        return 1
+
+# queued by Thread_sink.flush, so that the thread flushes its sink
+FLUSH = 'flush'
+
+class Thread_sink(Null_sink):
+
+    """
+    Attribute description:
+    sink: sink actually writing outputs
+    batch: maximum number of queued outputs taken by the thread at once
+    queue: participant states (copied) waiting to be written
+    error: exception raised while writing in the background thread, or
+        RuntimeError if sink reported a failure (write not returning 1 or
+        flush returning -1), if any
+    Outputs are written by a background thread, so evolution processes do not
+        wait for disks.
+    """
+
+    def __init__(self, sink, batch = 64):
+        """
+        Create Thread sink writing through a given sink, and start the
+            background thread.
+        """
+        self.sink = sink
+        self.batch = batch
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        """
+        Background thread. Writes queued outputs, and flushes sink only when
+            asked to (FLUSH, queued by flush), so that sink keeps buffering
+            as it would without this thread.
+        """
+        done = 0
+        while not done:
+            items = [self.queue.get()]
+            # collect more, up to self.batch
+            while len(items) < self.batch:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in items:
+                # the sentinel (None) stops the thread even if writes fail
+                if item is None:
+                    done = 1
+                    continue
+                try:
+                    if item is FLUSH:
+                        if self.sink.flush() < 0:
+                            self.error = RuntimeError('failed to flush')
+                    elif self.sink.write(item[0],item[1]) <= 0:
+                        self.error = RuntimeError('failed to write schedule %d' % (item[0]))
+                except Exception as e:
+                    self.error = e
+            for item in items:
+                self.queue.task_done()
+
+    def write(self, num_schedule, status):
+        """
+        Queue participant states of a schedule (copied), and return
+            immediately.
+        If the background thread has failed, returns -1 (error)
+        If successful, returns 1
+        """
+        if self.error is not None:
+            return -1
+        self.queue.put((num_schedule,np.array(status)))
+        return 1
+
+    def flush(self):
+        """
+        Wait until all queued outputs are written and sink is flushed.
+        If the background thread has failed, returns -1 (error)
+        If successful, returns 1
+        """
+        if self.thread.is_alive():
+            self.queue.put(FLUSH)
+        self.queue.join()
+        if self.error is not None:
+            return -1
+        return 1
+
+    def close(self):
+        """
+        Write all queued outputs, stop the background thread and close sink
+            (which flushes it).
+        If the background thread has failed, returns -1 (error)
+        If successful, returns 1
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if (self.sink.close() < 0) and (self.error is None):
+            self.error = RuntimeError('failed to close')
+        if self.error is not None:
+            return -1
+        return 1
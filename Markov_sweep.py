@@ -0,0 +1,396 @@
+"""
+Markov sweep Class v1.0
+This class implements parameter sweeps and sensitivity analyses over ECM
+entries of a Markov learning class
+"""
+
+# Markov sweep class
+# ECMs estimated from small samples (e.g., 18/32) are uncertain. This class
+# evolves many perturbed ECM sets at once, and calculates sensitivities
+# (Jacobians) of final participant states with respect to ECM entries with
+# forward-mode differentiation along the trajectory.
+#
+# Perturbations keep columns stochastic. Entry (c, i, j) is moved by delta,
+# and the other entries of column j are scaled by (1 - p - delta) / (1 - p)
+# (p = ECM_c[i][j]), so that zero entries stay zero.
+
+import numpy as np
+
+class Markov_sweep(object):
+
+    """
+    Attribute description:
+    ML: Markov learning class providing ECMs, t0 and intervention schedules
+    ECM_stack: ECMs of ML (conditions x size x size, dense)
+    ECM_sets: perturbed ECM sets (sets x conditions x size x size)
+    perturbation: perturbation of each set, (condition, i, j, delta) for
+        grids, or the noise scale for random samples
+    final: final participant states of each set and schedule (sets x
+        schedules x size), calculated by evolution_sweep
+    status: participant states of each set at all ts (sets x schedules x
+        length x size), if kept by evolution_sweep
+    jacobian: derivatives of final participant states with respect to ECM
+        entries (schedules x conditions x size (i) x size (j) x size (state)),
+        calculated by sensitivity
+    bands: credible bands of participant states (schedules x length x size x
+        quantiles), calculated by posterior_trajectory
+    posterior_mean: posterior means of participant states (schedules x
+        length x size)
+    effect_bands: credible bands of t-test results of comp_all_schedules_t
+        (schedules - 1 x 4 x quantiles), calculated by posterior_effects
+    effect_samples: t-test results per ECM set (sets x schedules - 1 x 4)
+    """
+
+    # attributes
+    ML = 0
+    ECM_stack = []
+    ECM_sets = []
+    perturbation = []
+    final = []
+    status = []
+    jacobian = []
+    bands = []
+    posterior_mean = []
+    effect_bands = []
+    effect_samples = []
+
+    def __init__(self, ML):
+        """
+        Create Markov sweep class
+        Requires a Markov learning class with ECMs, t0 and schedules set.
+        """
+        self.ML = ML
+        self.ECM_sets = []
+        self.perturbation = []
+        self.final = []
+        self.status = []
+        self.jacobian = []
+        self.update()
+
+    def update(self):
+        """
+        Read ECMs from the Markov learning class again.
+        If ECMs cannot be stacked, returns -1 (error)
+        If successful, returns 1
+        """
+        if self.ML.stack_ECM() < 0:
+            return -1
+        if self.ML.sparse:
+            self.ECM_stack = np.array([m.toarray() for m in self.ML.ECM_stack])
+        else:
+            self.ECM_stack = np.array(self.ML.ECM_stack)
+        return 1
+
+    def perturb_grid(self, deltas, entries=None):
+        """
+        Create perturbed ECM sets, one per ECM entry and delta.
+        deltas: list of changes of entries (e.g., [-0.05, 0.05])
+        entries: list of (condition, i, j). If None, all entries whose
+            columns have more than one nonzero entry.
+        Deltas moving an entry out of [0, 1] are clipped.
+        Results are stored in self.ECM_sets and self.perturbation.
+        Returns the number of sets.
+        """
+        conditions, size = self.ECM_stack.shape[0], self.ECM_stack.shape[1]
+        if entries is None:
+            nonzero = np.sum(self.ECM_stack > 0,axis=1)
+            entries = [(c,i,j) for c in range(conditions) for i in range(size)
+                       for j in range(size) if nonzero[c,j] > 1]
+
+        sets = []
+        perturbation = []
+        for c, i, j in entries:
+            for delta in deltas:
+                p = self.ECM_stack[c,i,j]
+                delta = min(max(delta,-p),1.0-p)
+                sets.append(perturb_entry(self.ECM_stack,c,i,j,delta))
+                perturbation.append((c,i,j,delta))
+        self.ECM_sets = np.array(sets).reshape(-1,conditions,size,size)
+        self.perturbation = perturbation
+        return len(sets)
+
+    def perturb_random(self, samples, scale=0.1, seed=None):
+        """
+        Create randomly perturbed ECM sets. Each entry is multiplied by
+            exp(scale x N(0, 1)), and each column is normalized again, so
+            columns stay stochastic and zero entries stay zero.
+        The first set is always the unperturbed one.
+        Results are stored in self.ECM_sets and self.perturbation.
+        Returns the number of sets.
+        """
+        rng = np.random.default_rng(seed)
+        noise = np.exp(scale*rng.standard_normal((samples,)+self.ECM_stack.shape))
+        noise[0] = 1.0
+        sets = self.ECM_stack[None] * noise
+        self.ECM_sets = sets / np.sum(sets,axis=2,keepdims=True)
+        self.perturbation = [scale] * samples
+        return samples
+
+    def perturb_posterior(self, samples, counts=None, prior=1.0, seed=None):
+        """
+        Draw ECM sets from the posterior of raw numbers. Each column of each
+            ECM follows a Dirichlet distribution with parameters counts +
+            prior (e.g., 14 of 32 participants -> Dirichlet(14 + 1, 18 + 1)
+            with the uniform prior), so small samples give wide posteriors.
+        counts: raw numbers (conditions x size x size). If None, raw numbers
+            kept by ECMs (ECM_matrix.counts, set with setmatrix_rawvalue or
+            setECM_all(raw=1)) are used.
+        prior: Dirichlet prior added to every count. Zero counts with prior 0
+            stay zero.
+        Columns without any count (and prior 0) keep the current ratios.
+        Results are stored in self.ECM_sets and self.perturbation.
+        If counts are not given and any ECM has no raw numbers, returns -1
+            (error)
+        If the shape of counts does not match, returns -2 (error)
+        If successful, returns the number of sets.
+        """
+        if counts is None:
+            counts = []
+            for now in self.ML.ECM:
+                if now.counts is None:
+                    return -1
+                counts.append(now.counts.toarray() if hasattr(now.counts,'toarray') else now.counts)
+        alpha = np.array(counts,dtype=float) + prior
+        if alpha.shape != self.ECM_stack.shape:
+            return -2
+
+        # Dirichlet draws = gamma draws normalized per column
+        rng = np.random.default_rng(seed)
+        sets = rng.gamma(np.broadcast_to(alpha,(samples,)+alpha.shape))
+        total = np.sum(sets,axis=2,keepdims=True)
+        empty = np.broadcast_to(np.sum(alpha,axis=1,keepdims=True) <= 0,total.shape)
+        sets = np.where(np.broadcast_to(empty,sets.shape),self.ECM_stack[None],sets/np.where(empty,1.0,total))
+        self.ECM_sets = sets
+        self.perturbation = [prior] * samples
+        return samples
+
+    def posterior_trajectory(self, quantiles=(0.025,0.5,0.975), chunk=0, subset=None):
+        """
+        Calculate credible bands of participant states at all ts for all ECM
+            sets (e.g., perturb_posterior) and schedules (or a subset).
+        All sets are evolved at once for a chunk of schedules
+            (evolution_sweep), and quantiles over sets are taken per chunk, so
+            memory is bounded by sets x chunk x length x size.
+        chunk: how many schedules are evolved together. If 0, as many as fit
+            in about 256MB.
+        Results are stored in self.bands (schedules x length x size x
+            quantiles) and self.posterior_mean (schedules x length x size).
+        Error codes are identical to those of evolution_sweep.
+        If successful, returns 1
+        """
+        if subset is None:
+            subset = np.arange(self.ML.schedules)
+        subset = np.asarray(subset,dtype=int).reshape(-1)
+        if chunk <= 0:
+            chunk = max(1,int((256 << 20) / (max(1,len(self.ECM_sets)) * self.ML.length * self.ML.size * 8)))
+
+        bands = np.zeros((len(subset),self.ML.length,self.ML.size,len(quantiles)))
+        mean = np.zeros((len(subset),self.ML.length,self.ML.size))
+        for start in range(0,len(subset),chunk):
+            error = self.evolution_sweep(None,subset[start:start+chunk],keep=1)
+            if error < 0:
+                return error
+            # quantiles over sets
+            bands[start:start+chunk] = np.moveaxis(np.quantile(self.status,quantiles,axis=0),0,-1)
+            mean[start:start+chunk] = np.mean(self.status,axis=0)
+        self.status = []
+        self.bands = bands
+        self.posterior_mean = mean
+        return 1
+
+    def posterior_effects(self, cond1, cond2, types, quantiles=(0.025,0.5,0.975), chunk=0):
+        """
+        Calculate credible bands of t-test results of comp_all_schedules_t
+            (each regular schedule vs. the control schedule; tvalue, pvalue,
+            Sidak's pvalue and Cohen's D) over ECM sets (e.g.,
+            perturb_posterior).
+        Sets are evolved in chunks (evolution_sweep), and each set is compared
+            at once for all schedules (Markov_learning.comp_groups and
+            t_test_batch), so memory is bounded by chunk x schedules x length
+            x size.
+        chunk: how many sets are evolved together. If 0, as many as fit in
+            about 256MB.
+        Results are stored in self.effect_bands (schedules - 1 x 4 x
+            quantiles) and self.effect_samples (sets x schedules - 1 x 4).
+        If the Markov learning class is not set to deal with regular
+            schedules, returns -1 (error)
+        If cond1 or cond2 is out of boundary (self.ML.size), returns -2
+            (error)
+        If types is out of boundary (< 0 or > 3), returns -3 (error)
+        If there is no ECM set, returns -4 (error)
+        If evolution_sweep fails (e.g., status_t0 of the Markov learning
+            class was not set), returns -5 (error)
+        If successful, returns 1
+        """
+        ML = self.ML
+        if ML.regular_schedule != 1:
+            return -1
+        if (cond1 < 0) or (cond1 >= ML.size) or (cond2 < 0) or (cond2 >= ML.size):
+            return -2
+        if (types < 0) or (types > 3):
+            return -3
+        if len(self.ECM_sets) == 0:
+            return -4
+        if chunk <= 0:
+            chunk = max(1,int((256 << 20) / (ML.schedules * ML.length * ML.size * 8)))
+
+        sets = self.ECM_sets
+        samples = np.zeros((len(sets),ML.schedules-1,4))
+        for start in range(0,len(sets),chunk):
+            if self.evolution_sweep(sets[start:start+chunk],keep=1) < 0:
+                self.status = []
+                return -5
+            for k in range(len(self.status)):
+                status = self.status[k]
+                group1, group2 = ML.comp_groups(status[:-1],status[-1],cond1,cond2,types)
+                samples[start+k] = ML.t_test_batch(group1,group2)
+        self.status = []
+        self.effect_samples = samples
+        self.effect_bands = np.moveaxis(np.quantile(samples,quantiles,axis=0),0,-1)
+        return 1
+
+    def evolution_sweep(self, ECM_sets=None, subset=None, keep=0):
+        """
+        Perform evolution for all ECM sets and intervention schedules (or a
+            subset of them) at once. Participant states of all sets are one
+            (sets, schedules, size) array, and each t is one batched product
+            per condition.
+        ECM_sets: sets x conditions x size x size. If None, self.ECM_sets.
+        keep: if 1, participant states at all ts are stored in self.status.
+            Otherwise, only final states are stored in self.final.
+        Participant states are renormalized as Markov_learning.evolution_batch
+            (Markov_learning.set_precision).
+        If any schedule number in subset is out of boundary, returns -1
+            (error)
+        If there is no ECM set, returns -2 (error)
+        If self.ML.status_t0 was not set, returns -4 (error)
+        If successful, returns 1
+        """
+        if ECM_sets is None:
+            ECM_sets = self.ECM_sets
+        ECM_sets = np.asarray(ECM_sets,dtype=float)
+        if len(ECM_sets) == 0:
+            return -2
+        if subset is None:
+            subset = np.arange(self.ML.schedules)
+        subset = np.asarray(subset,dtype=int).reshape(-1)
+        if np.any(subset < 0) or np.any(subset >= self.ML.schedules):
+            return -1
+        if not np.any(self.ML.status_t0):
+            return -4
+
+        cond = self.ML.schedule_window(subset,0,self.ML.length).astype(int)
+        renormalize = self.ML.renormalize
+        total = np.sum(self.ML.status_t0,dtype=np.float64)
+        state = np.tile(np.asarray(self.ML.status_t0,dtype=float),(len(ECM_sets),len(subset),1))
+        # transposed for row states (conditions x sets x size x size)
+        stack_t = np.ascontiguousarray(np.transpose(ECM_sets,(1,0,3,2)))
+        if keep:
+            self.status = np.zeros((len(ECM_sets),len(subset),self.ML.length,self.ML.size))
+
+        for i in range(self.ML.length):
+            for c in range(self.ML.conditions):
+                now = (cond[:,i] == c)
+                if np.any(now):
+                    state[:,now] = np.matmul(state[:,now],stack_t[c])
+            if (renormalize > 0) and ((i+1) % renormalize == 0):
+                self.ML.renormalize_state(state,total)
+            if keep:
+                self.status[:,:,i] = state
+
+        self.final = state
+        return 1
+
+    def sensitivity(self, subset=None, projected=1, chunk=0):
+        """
+        Calculate the Jacobian of final participant states with respect to
+            every ECM entry, with forward-mode differentiation along the
+            trajectory. With x(t+1) = ECM_c . x(t), the tangent of each entry
+            (c, i, j) follows
+            dx(t+1) = ECM_c . dx(t) + e_i x_j(t) (if c is applied at t),
+            so one evolution gives all derivatives (O(conditions x size^4)
+            per t, instead of reruns per entry).
+        projected: if 1, derivatives along stochastic perturbations (see
+            perturb_grid: the rest of the column is scaled to keep its sum),
+            i.e., J(i,j) - sum over k != i of ECM_c[k][j] / (1 - ECM_c[i][j])
+            J(k,j). If 0, derivatives with respect to free entries.
+        chunk: how many schedules are differentiated together. If 0, all.
+        Results are stored in self.jacobian (schedules x conditions x size
+            (i) x size (j) x size (state)) and self.final.
+        If any schedule number in subset is out of boundary, returns -1
+            (error)
+        If self.ML.status_t0 was not set, returns -4 (error)
+        If successful, returns 1
+        """
+        if subset is None:
+            subset = np.arange(self.ML.schedules)
+        subset = np.asarray(subset,dtype=int).reshape(-1)
+        if np.any(subset < 0) or np.any(subset >= self.ML.schedules):
+            return -1
+        if not np.any(self.ML.status_t0):
+            return -4
+
+        conditions, size = self.ML.conditions, self.ML.size
+        if chunk <= 0:
+            chunk = len(subset)
+        cond_all = self.ML.schedule_window(subset,0,self.ML.length).astype(int)
+        self.jacobian = np.zeros((len(subset),conditions,size,size,size))
+        self.final = np.zeros((len(subset),size))
+        I = np.arange(size)[:,None]
+        J = np.arange(size)[None,:]
+
+        for start in range(0,len(subset),chunk):
+            cond = cond_all[start:start+chunk]
+            state = np.tile(np.asarray(self.ML.status_t0,dtype=float),(len(cond),1))
+            tangent = np.zeros((len(cond),conditions,size,size,size))
+            for t in range(self.ML.length):
+                for c in range(conditions):
+                    now = np.where(cond[:,t] == c)[0]
+                    if len(now) == 0:
+                        continue
+                    M = self.ECM_stack[c]
+                    # propagate tangents, then add e_i x_j(t) for entries of c
+                    tangent[now] = np.matmul(tangent[now],M.T)
+                    tangent[now[:,None,None],c,I[None],J[None],I[None]] += state[now][:,None,:]
+                    state[now] = np.dot(state[now],M.T)
+            self.jacobian[start:start+chunk] = tangent
+            self.final[start:start+chunk] = state
+
+        if projected:
+            self.jacobian = project(self.jacobian,self.ECM_stack)
+        return 1
+
+def perturb_entry(ECM_stack, c, i, j, delta):
+    """
+    Returns a copy of ECM_stack with entry (c, i, j) moved by delta, and the
+        other entries of column j scaled to keep the column sum.
+    """
+    result = np.array(ECM_stack,dtype=float)
+    p = result[c,i,j]
+    rest = 1.0 - p
+    if rest > 0:
+        result[c,:,j] = result[c,:,j] * (rest - delta) / rest
+    else:
+        # the entry had the whole column; spread the rest evenly
+        result[c,:,j] = -delta / (len(result[c,:,j]) - 1)
+    result[c,i,j] = p + delta
+    return result
+
+def project(jacobian, ECM_stack):
+    """
+    Convert derivatives with respect to free entries (schedules x conditions
+        x size x size x size) into derivatives along stochastic perturbations
+        (perturb_entry).
+    """
+    size = ECM_stack.shape[1]
+    rest = 1.0 - ECM_stack
+    # weights of other entries in the same column: ECM[k][j] / (1 - ECM[i][j])
+    with np.errstate(divide='ignore',invalid='ignore'):
+        weight = ECM_stack[:,None,:,:] / rest[:,:,None,:]
+    # the entry had the whole column -> spread evenly
+    full = rest[:,:,None,:] <= 0
+    weight = np.where(full,1.0/(size-1),weight)
+    # no weight on the entry itself
+    weight[:,np.arange(size),np.arange(size),:] = 0.0
+    # weight: conditions x i x k x j
+    return jacobian - np.einsum('cikj,sckjx->scijx',weight,jacobian)
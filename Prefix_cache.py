@@ -0,0 +1,185 @@
+"""
+Prefix cache Class v1.0
+This class implements a prefix-trie cache of participant states for
+intervention schedules sharing common prefixes
+"""
+
+# Prefix cache Class
+# Each node in the trie represents a prefix of intervention schedules
+# (a sequence of conditions), and stores participant states reached by it.
+
+import numpy as np
+from collections import OrderedDict
+
+class Prefix_node(object):
+
+    """
+    Attribute description:
+    parent: node representing the prefix one step shorter
+    condition: intervention condition applied at the last step of the prefix
+    depth: length of the prefix
+    state: participant states reached by the prefix
+    children: nodes representing the prefix one step longer (per condition)
+    """
+
+    def __init__(self, parent, condition, depth, state):
+        """
+        Create a node of the prefix trie
+        """
+        self.parent = parent
+        self.condition = condition
+        self.depth = depth
+        self.state = state
+        self.children = {}
+
+class Prefix_cache(object):
+
+    """
+    Attribute description:
+    root: node representing the empty prefix (participant states at t0)
+    max_nodes: memory cap, maximum number of cached nodes (state vectors).
+        0 means no cap.
+    nodes: number of currently cached nodes (except the root)
+    lru: cached nodes from the least recently used one to the most recently
+        used one
+    hits: number of evolution steps served from the cache
+    misses: number of evolution steps which had to be calculated
+    evictions: number of nodes evicted due to the memory cap
+    renormalize: if > 0, states are rescaled every renormalize steps so that
+        the number of all participants stays that of t0 (total), as
+        Markov_learning.set_precision
+    """
+
+    # attributes
+    # root node (t0)
+    root = 0
+    # memory cap (nodes)
+    max_nodes = 0
+    nodes = 0
+    # statistics
+    hits = 0
+    misses = 0
+    evictions = 0
+    # renormalization
+    renormalize = 0
+    total = 0.0
+
+    def __init__(self, t0, max_nodes = 0, renormalize = 0):
+        """
+        Create Prefix cache class
+        Requires participant states at t0, the memory cap (maximum number of
+            cached nodes, 0 = no cap) and the renormalization interval (0 =
+            none).
+        """
+        self.root = Prefix_node(None,-1,0,np.asarray(t0,dtype=float))
+        self.max_nodes = max_nodes
+        self.renormalize = renormalize
+        self.total = float(np.sum(self.root.state))
+        self.nodes = 0
+        self.lru = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def evolve(self, schedule, ECM_stack, out = None):
+        """
+        Perform evolution with a given intervention schedule (sequence of
+            conditions) and stacked ECMs (conditions x size x size, or a list
+            of sparse matrices).
+        The longest prefix of the schedule already in the trie is reused,
+            and only the rest is evolved and inserted into the trie.
+        If out is given (length x size), participant states at all ts are
+            stored in it.
+        Returns participant states at the end of the schedule.
+        """
+        node = self.root
+        path = []
+        t = 0
+
+        # reuse the cached prefix
+        while t < len(schedule):
+            child = node.children.get(int(schedule[t]))
+            if child is None:
+                break
+            node = child
+            path.append(node)
+            if out is not None:
+                out[t] = node.state
+            t = t + 1
+        self.hits = self.hits + t
+
+        # evolve the rest and insert it into the trie
+        self.misses = self.misses + len(schedule) - t
+        while t < len(schedule):
+            condition = int(schedule[t])
+            state = ECM_stack[condition].dot(node.state)
+            # a node depends only on its prefix, so rescaled states can be
+            # cached and shared
+            if (self.renormalize > 0) and ((t+1) % self.renormalize == 0):
+                state = state * (self.total / np.sum(state))
+            child = Prefix_node(node,condition,t+1,state)
+            node.children[condition] = child
+            self.nodes = self.nodes + 1
+            node = child
+            path.append(node)
+            if out is not None:
+                out[t] = state
+            t = t + 1
+
+        # mark the path as recently used, from the deepest node to the root.
+        # thus, a node is always more recent than its descendants, and the
+        # least recently used node is always a leaf.
+        for now in reversed(path):
+            key = id(now)
+            if key in self.lru:
+                self.lru.move_to_end(key)
+            else:
+                self.lru[key] = now
+
+        # memory cap exceeded? evict
+        if self.max_nodes > 0:
+            while self.nodes > self.max_nodes:
+                self.evict()
+
+        return node.state
+
+    def evict(self):
+        """
+        Evict the least recently used node (always a leaf, a deep node).
+        If there is no node to evict, returns -1 (error)
+        If successful, returns 1
+        """
+        if len(self.lru) == 0:
+            return -1
+        key, node = self.lru.popitem(last = False)
+        del node.parent.children[node.condition]
+        node.parent = None
+        self.nodes = self.nodes - 1
+        self.evictions = self.evictions + 1
+        return 1
+
+    def clear(self):
+        """
+        Remove all cached nodes except the root, and reset statistics.
+        """
+        self.root.children = {}
+        self.lru = OrderedDict()
+        self.nodes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """
+        Report cache statistics.
+        Returns a dictionary containing hits, misses, hit ratio, evictions,
+            number of cached nodes and bytes used by cached states.
+        """
+        total = self.hits + self.misses
+        if total > 0:
+            ratio = float(self.hits) / float(total)
+        else:
+            ratio = 0.0
+        return {'hits':self.hits, 'misses':self.misses, 'hit_ratio':ratio,
+                'evictions':self.evictions, 'nodes':self.nodes,
+                'bytes':self.nodes * self.root.state.nbytes}
@@ -0,0 +1,285 @@
+# Markov learning benchmark suite
+# Measures time and peak memory of evolution, comparison and statistics
+# methods over parameterised cases, and saves results as a JSON file, so that
+# results of different releases can be compared to detect regressions.
+
+## Usage
+## python benchmark.py                        quick cases (small sizes)
+## python benchmark.py --full                  all parameter combinations
+## python benchmark.py --cases evolution_all,comp_all_schedules_t
+## python benchmark.py --output new.json --compare old.json
+## Cases requiring more memory than --max-memory (MB, estimated) or more
+## work than --max-work (ECM products x size^2, estimated) are skipped and
+## recorded as "skipped".
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import Markov_learning as ml
+import Markov_sink as ms
+
+def create(conditions, size, length, schedules, seed=0, dtype=np.float64):
+    """
+    Create a Markov learning class with random ECMs, t0 and schedules.
+    """
+    rng = np.random.default_rng(seed)
+    Test = ml.Markov_learning(conditions,size,length,schedules,dtype)
+    # ECMs: random column-stochastic matrices
+    matrices = rng.random((conditions,size,size))
+    Test.setECM_all(matrices / np.sum(matrices,axis=1,keepdims=True))
+    Test.set_t0(rng.integers(10,100,size).astype(float))
+    # no output files
+    Test.set_sink(ms.Null_sink())
+    if schedules > 0:
+        for i in range(schedules):
+            Test.set_schedule(i,rng.integers(0,conditions,length))
+    return Test
+
+# cases: name -> (parameter grid (full), parameter grid (quick), setup, run,
+# estimated memory (bytes), estimated work)
+# setup (params) returns an object passed to run (object, params).
+
+def setup_evolution(p):
+    return create(2,p['size'],p['length'],p['schedules'])
+
+def setup_evolution_float32(p):
+    Test = create(2,p['size'],p['length'],p['schedules'],dtype=np.float32)
+    Test.set_precision(np.float32,100)
+    return Test
+
+def setup_evolution_step(p):
+    Test = setup_evolution(p)
+    Test.set_jit(0)
+    return Test
+
+def run_evolution_all(Test, p):
+    for i in range(p['schedules']):
+        Test.evolution_all(i)
+
+def run_evolution_batch(Test, p):
+    Test.evolution_batch()
+
+def memory_evolution(p):
+    return 8 * p['schedules'] * p['length'] * p['size']
+
+def memory_evolution_float32(p):
+    return 4 * p['schedules'] * p['length'] * p['size']
+
+def work_evolution(p):
+    return p['schedules'] * p['length'] * p['size'] * p['size']
+
+def setup_regular(p):
+    return create(3,p['size'],p['length'],-1)
+
+def run_regular(Test, p):
+    Test.set_regular_schedule(0,2)
+
+def memory_regular(p):
+    return 8 * (p['length'] // 2 + 1) * p['length'] * p['size']
+
+def work_regular(p):
+    return (p['length'] // 2 + 1) * p['length'] * p['size'] * p['size']
+
+def setup_regular_evolved(p):
+    Test = setup_regular(p)
+    Test.set_regular_schedule(0,2)
+    return Test
+
+def run_create_comp_matrix(Test, p):
+    Test.create_comp_matrix(1,Test.schedules-1,0,1)
+
+def run_comp_all_schedules_t(Test, p):
+    Test.comp_all_schedules_t(0,1,0)
+
+def run_comp_all_schedules_mixed(Test, p):
+    Test.comp_all_schedules_mixed(0,1,0)
+
+def memory_comp(p):
+    return 8 * (p['length'] // 2 + 1) * p['length'] * p['size'] + 48 * 2 * p['length']
+
+def setup_startup(p):
+    return None
+
+def run_startup(now, p):
+    # a fresh interpreter, so that modules are not already imported
+    code = ('import sys, Markov_learning, Markov_comp, Markov_sweep; '
+            'print(\',\'.join(m for m in (\'pandas\',\'scipy\',\'statsmodels\',\'numba\',\'llvmlite\') if m in sys.modules))')
+    out = subprocess.run([sys.executable,'-c',code],capture_output=True,text=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)),check=True)
+    return {'loaded':[m for m in out.stdout.strip().split(',') if m]}
+
+def memory_startup(p):
+    return 0
+
+def run_parallel_exit(now, p):
+    # the kernel (set_jit) followed by parallel fits, in a new process which
+    # should exit (threads started before forking workers once hung it)
+    code = ('import Markov_learning as ml, Markov_sink as ms; '
+            'Test = ml.Markov_learning(3,2,20,-1); Test.set_sink(ms.Null_sink()); '
+            'Test.setECM_ratio(0,[[18.0/32.0,4.0/40.0],[14.0/32.0,36.0/40.0]]); '
+            'Test.setECM_ratio(1,[[30.0/34.0,12.0/33.0],[4.0/34.0,21.0/33.0]]); '
+            'Test.setECM_ratio(2,[[32.0/45.0,14.0/50.0],[13.0/45.0,36.0/50.0]]); '
+            'Test.set_t0([111,127]); Test.set_jit(%d); Test.set_regular_schedule(0,2); '
+            'print(Test.comp_all_schedules_mixed(0,1,0,workers=2))' % (p['jit']))
+    try:
+        out = subprocess.run([sys.executable,'-W','ignore','-c',code],capture_output=True,text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)),timeout=120)
+    except subprocess.TimeoutExpired:
+        raise RuntimeError('parallel_exit: the process did not exit (jit = %d)' % (p['jit']))
+    if (out.returncode != 0) or (out.stdout.strip() != '1'):
+        raise RuntimeError('parallel_exit: failed (jit = %d)\n%s' % (p['jit'],out.stderr))
+    return {'exited':True}
+
+def work_startup(p):
+    return 0
+
+EVOLUTION_FULL = {'size':[2,3,10,100,1000], 'length':[100,10**4,10**6], 'schedules':[5,50,10**4]}
+EVOLUTION_QUICK = {'size':[2,3,10], 'length':[100,10**4], 'schedules':[5,50]}
+
+CASES = {
+    'evolution_all': (EVOLUTION_FULL, EVOLUTION_QUICK, setup_evolution,
+        run_evolution_all, memory_evolution, work_evolution),
+    'evolution_batch': (EVOLUTION_FULL, EVOLUTION_QUICK, setup_evolution,
+        run_evolution_batch, memory_evolution, work_evolution),
+    # without the kernel for small ECMs (set_jit), NumPy calls per t
+    'evolution_batch_step': (EVOLUTION_FULL, EVOLUTION_QUICK, setup_evolution_step,
+        run_evolution_batch, memory_evolution, work_evolution),
+    # float32 states, renormalised every 100 steps (set_precision)
+    'evolution_batch_float32': (EVOLUTION_FULL, EVOLUTION_QUICK, setup_evolution_float32,
+        run_evolution_batch, memory_evolution_float32, work_evolution),
+    'set_regular_schedule': ({'size':[2,3,10,100], 'length':[100,1000,10**4]},
+        {'size':[2,3], 'length':[100,1000]}, setup_regular, run_regular,
+        memory_regular, work_regular),
+    'create_comp_matrix': ({'size':[2,3,10], 'length':[100,1000,10**4]},
+        {'size':[2,3], 'length':[100,1000]}, setup_regular_evolved,
+        run_create_comp_matrix, memory_comp, work_regular),
+    'comp_all_schedules_t': ({'size':[2,3,10], 'length':[100,1000,10**4]},
+        {'size':[2,3], 'length':[100,1000]}, setup_regular_evolved,
+        run_comp_all_schedules_t, memory_comp, work_regular),
+    'comp_all_schedules_mixed': ({'size':[2,3,10], 'length':[20,100,400]},
+        {'size':[2], 'length':[20,100]}, setup_regular_evolved,
+        run_comp_all_schedules_mixed, memory_comp, work_regular),
+    # import time of modules in a new process (pandas, scipy and statsmodels
+    # should not be loaded until statistics are used, nor numba until the
+    # compiled kernel is used)
+    'startup': ({}, {}, setup_startup, run_startup, memory_startup, work_startup),
+    # the process should exit after the kernel and parallel fits
+    'parallel_exit': ({'jit':[0,1,2]}, {'jit':[1,2]}, setup_startup, run_parallel_exit,
+        memory_startup, work_startup),
+}
+
+def measure(setup, run, p, repeat):
+    """
+    Measure the best time of repeat runs (without setup), and peak memory
+        of one more run including setup (traced separately, since tracing
+        slows allocations down).
+    run may return a dictionary of additional information (kept from the
+        last timed run).
+    Returns (seconds, peak memory in bytes, information).
+    """
+    best = float('inf')
+    info = None
+    for i in range(repeat):
+        now = setup(p)
+        start = time.perf_counter()
+        value = run(now,p)
+        best = min(best,time.perf_counter()-start)
+        if isinstance(value,dict):
+            info = value
+
+    tracemalloc.start()
+    now = setup(p)
+    run(now,p)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, info
+
+def benchmark(names, full=0, repeat=3, max_memory=1024, max_work=10**10):
+    """
+    Run cases and return results (list of dictionaries).
+    """
+    results = []
+    for name in names:
+        grid_full, grid_quick, setup, run, memory, work = CASES[name]
+        grid = grid_full if full else grid_quick
+        keys = sorted(grid)
+        for values in itertools.product(*[grid[k] for k in keys]):
+            p = dict(zip(keys,values))
+            result = {'case':name, 'params':p}
+            if (memory(p) > max_memory * (1 << 20)) or (work(p) > max_work):
+                result['status'] = 'skipped'
+            else:
+                result['time'], result['peak_memory'], info = measure(setup,run,p,repeat)
+                if info is not None:
+                    result['info'] = info
+                result['status'] = 'ok'
+            results.append(result)
+            print(name, p, result['status'], result.get('time',''), result.get('peak_memory',''), result.get('info',''))
+            sys.stdout.flush()
+    return results
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with baseline results. Cases slower than baseline x
+        threshold (or using more peak memory than that) are regressions.
+    Returns the list of regressions.
+    """
+    old = {}
+    for result in baseline['results']:
+        if result['status'] == 'ok':
+            old[(result['case'],json.dumps(result['params'],sort_keys=True))] = result
+    regressions = []
+    for result in results:
+        key = (result['case'],json.dumps(result['params'],sort_keys=True))
+        if (result['status'] != 'ok') or (key not in old):
+            continue
+        for measure_name in ('time','peak_memory'):
+            if result[measure_name] > old[key][measure_name] * threshold:
+                regressions.append({'case':result['case'], 'params':result['params'],
+                    'measure':measure_name, 'old':old[key][measure_name],
+                    'new':result[measure_name]})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Markov learning benchmark suite')
+    parser.add_argument('--cases',default=','.join(CASES),help='comma-separated case names')
+    parser.add_argument('--full',action='store_true',help='all parameter combinations')
+    parser.add_argument('--repeat',type=int,default=3,help='timed runs per case (best one is kept)')
+    parser.add_argument('--max-memory',type=float,default=1024,help='skip cases estimated to need more memory (MB)')
+    parser.add_argument('--max-work',type=float,default=1e10,help='skip cases estimated to need more work')
+    parser.add_argument('--output',default='benchmark.json',help='JSON file for results')
+    parser.add_argument('--compare',default='',help='JSON file of baseline results')
+    parser.add_argument('--threshold',type=float,default=1.2,help='regression threshold (ratio to baseline)')
+    args = parser.parse_args()
+
+    names = [name for name in args.cases.split(',') if name]
+    for name in names:
+        if name not in CASES:
+            parser.error('unknown case: %s' % (name))
+
+    results = benchmark(names,args.full,args.repeat,args.max_memory,args.max_work)
+    output = {'meta':{'python':platform.python_version(), 'numpy':np.__version__,
+                      'platform':platform.platform(), 'date':time.strftime('%Y-%m-%d %H:%M:%S')},
+              'results':results}
+    with open(args.output,'w') as f:
+        json.dump(output,f,indent=1)
+
+    # regressions?
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results,baseline,args.threshold)
+        for r in regressions:
+            print('regression:',r['case'],r['params'],r['measure'],r['old'],'->',r['new'])
+        if len(regressions) > 0:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()